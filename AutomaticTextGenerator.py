@@ -1,10 +1,26 @@
 # -*- coding: cp1252 -*-
 #####################IMPORTS###################
 from __future__ import division
+import os
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 import numpy as np
-import random
 import codecs
+import re
+import json
+import multiprocessing
+import itertools
+import collections
+import tempfile
+import shutil
+import functools
+import timeit
+# numba is optional. If it is installed, the kernels below are compiled. (See backend)
+try:
+    import numba
+except ImportError:
+    numba = None
 ######################IMPORTS/end##############
 
 ##########################################################################
@@ -26,11 +42,1574 @@ import codecs
 ##########################################################################
 ##########################################################################
 
+# The generator shared by the worker processes of AutomaticTextGenerator.generateBatch.
+batchGenerator = None
+
+
+def initBatchWorker(generator, path=None):
+    """
+    args:
+    generator: AutomaticTextGenerator object to share, or None when it is loaded from path.
+    path: Directory of a model saved by AutomaticTextGenerator.saveModel. (Defaults to None)
+    ---------------------------------------------------------------------------
+    Sets up the generator used by batchWorker in a worker process.
+    With fork the object is inherited read-only from the parent process,
+    otherwise it is memory-mapped from the saved model, so the arrays are only stored once.
+    """
+    global batchGenerator
+    if path is not None:
+        generator = AutomaticTextGenerator()
+        generator.loadModel(path, mmap=True)
+    batchGenerator = generator
+
+
+def batchWorker(args):
+    """
+    args:
+    args: Tuple (seed, N, model).
+    return:
+    Generated text.
+    ---------------------------------------------------------------------------
+    Generates one text of a batch with its own random stream, using the generator set by initBatchWorker.
+    """
+    seed, N, model = args
+    batchGenerator.model = model
+    batchGenerator.rng = np.random.RandomState(seed)
+    batchGenerator.generateText(N)
+    return batchGenerator.newtext
+
+
+def alignOffset(filename, offset):
+    """
+    args:
+    filename: Name of UTF-8 encoded file.
+    offset: Position in bytes.
+    return:
+    The first position at or after offset, which is the start of a character.
+    """
+    with open(filename, 'rb') as f:
+        f.seek(offset)
+        # UTF-8 continuation bytes are 0b10xxxxxx. A character is at most 4 bytes.
+        for byte in bytearray(f.read(4)):
+            if byte & 0xC0 != 0x80:
+                break
+            offset += 1
+    return offset
+
+
+def trainShard(args):
+    """
+    args:
+    args: Tuple (symbolList, letters, filename, start, stop, models, countSymbols, chunkSize).
+    return:
+    Dictionary of the counts of the shard, merged by AutomaticTextGenerator.trainParallel.
+    ---------------------------------------------------------------------------
+    Counts the bytes start to stop of filename with a new AutomaticTextGenerator, in a worker process.
+
+    The letters at the start (head) and end (tail) of the shard are not counted as words,
+    since they may belong to words that continue in the neighbouring shards.
+    They are returned instead, together with the first and last symbol and word of the shard,
+    so the pairs across the shard boundaries can be counted when the shards are merged.
+    """
+    symbolList, letters, filename, start, stop, models, countSymbols, chunkSize = args
+    generator = AutomaticTextGenerator()
+    generator.symbolList = list(symbolList)
+    generator.alphabet = dict.fromkeys(symbolList, 0)
+    generator.cleanAlphabet = dict.fromkeys(letters, 0)
+    generator.createSymbolTables()
+    generator.defined = True
+    if 2 in models:
+        generator.pairCounts = np.zeros((len(symbolList), len(symbolList)), dtype=np.int64)
+    # The head is not counted as words, so model 3 is left out until the head has been read.
+    symbolModels = tuple(model for model in models if model != 3)
+    head, inHead = u"", 3 in models
+    firstSymbol = None
+    decoder = codecs.getincrementaldecoder('UTF-8')()
+    with open(filename, 'rb') as f:
+        f.seek(start)
+        position = start
+        while position < stop:
+            data = f.read(min(chunkSize, stop - position))
+            if not data:
+                break
+            position += len(data)
+            chunk = decoder.decode(data, position >= stop)
+            if firstSymbol is None and 2 in models:
+                codePoints = np.frombuffer(chunk.encode('utf-32-le'), dtype=np.uint32)
+                codes = generator.symbolCodes[np.minimum(codePoints, len(generator.symbolCodes) - 1)]
+                codes = codes[codes >= 0]
+                if len(codes):
+                    firstSymbol = int(codes[0])
+            if inHead:
+                # Split chunk into the letters that continue the head, and the rest.
+                match = generator.wordPattern.match(chunk)
+                k = match.end() if match else 0
+                head += chunk[:k]
+                if k:
+                    generator.feedChunk(chunk[:k], countSymbols, False, symbolModels)
+                if k == len(chunk):
+                    continue
+                inHead = False
+                chunk = chunk[k:]
+            generator.feedChunk(chunk, countSymbols, False, models)
+    generator.consolidateWordPairs()
+    symbolCounts = np.array([generator.alphabet[i] for i in symbolList], dtype=np.int64)
+    return {'symbolCounts': symbolCounts, 'symbolCount': generator.symbolCount,
+            'pairCounts': generator.pairCounts, 'firstSymbol': firstSymbol, 'lastSymbol': generator.lastSymbol,
+            'vocabulary': generator.vocabulary, 'wordCounts': generator.wordCounts,
+            'wordPairKeys': generator.wordPairKeys, 'wordPairCounts': generator.wordPairCounts,
+            'wordCount': generator.wordCount, 'lastWord': generator.lastWord,
+            'head': head, 'tail': generator.partialWord, 'allLetters': inHead}
+
+
+def aliasTable(probs):
+    """
+    args:
+    probs: List of probabilities. Must accumulate to 1.0.
+    return:
+    Tuple of lists. (aliasProbs, aliasIndices)
+    ---------------------------------------------------------------------------
+    Creates a Walker/Vose alias table for a discrete distribution.
+
+    To draw index j with probability probs[j], pick a column k uniformly at random,
+    then return k with probability aliasProbs[k] and aliasIndices[k] otherwise.
+    """
+    k = len(probs)
+    scaled = [p * k for p in probs]
+    aliasProbs = [1.0] * k
+    aliasIndices = range(k)
+    # Split the columns into those with too little and too much probability.
+    small = [j for j in range(k) if scaled[j] < 1.0]
+    large = [j for j in range(k) if scaled[j] >= 1.0]
+    while small and large:
+        s, l = small.pop(), large.pop()
+        # Fill up column s with probability from column l.
+        aliasProbs[s] = scaled[s]
+        aliasIndices[s] = l
+        scaled[l] = (scaled[l] + scaled[s]) - 1.0
+        if scaled[l] < 1.0:
+            small.append(l)
+        else:
+            large.append(l)
+    # Columns left in small or large are full (up to rounding errors), and keep aliasProbs 1.0.
+    return aliasProbs, aliasIndices
+
+
+################################################################################
+# Kernels for the inner loops of self.identifyProbabilities (alias tables) and self.generateText (walk).
+# They are compiled with numba when it is installed, and give the same results as the python code they replace.
+# Set backend to 'python' to use the python code even if numba is installed.
+################################################################################
+backend = 'numba' if numba is not None else 'python'
+
+
+def fillAliasTables(indptr, probs, states, aliasProbs, aliasIndices):
+    """
+    args:
+    indptr: Numpy array of int64. Row i is probs[indptr[i]:indptr[i+1]].
+    probs: Numpy array of float64. Probabilities of each row, accumulating to 1.0.
+    states: Numpy array of int64. Rows to create alias tables for.
+    aliasProbs: Numpy array of float64. The alias probabilities are written here, in the positions of probs.
+    aliasIndices: Numpy array of int32. The alias indices (positions within the row) are written here.
+    ---------------------------------------------------------------------------
+    Creates an alias table for each row in states, with the same steps as aliasTable.
+    """
+    for i in states:
+        start = indptr[i]
+        k = indptr[i + 1] - start
+        if k <= 1:
+            continue
+        scaled = np.empty(k)
+        small = np.empty(k, dtype=np.int64)
+        large = np.empty(k, dtype=np.int64)
+        numSmall = 0
+        numLarge = 0
+        for j in range(k):
+            scaled[j] = probs[start + j] * k
+            aliasProbs[start + j] = 1.0
+            aliasIndices[start + j] = j
+        # The columns are pushed and popped in the same order as the lists of aliasTable.
+        for j in range(k):
+            if scaled[j] < 1.0:
+                small[numSmall] = j
+                numSmall += 1
+            else:
+                large[numLarge] = j
+                numLarge += 1
+        while numSmall > 0 and numLarge > 0:
+            numSmall -= 1
+            numLarge -= 1
+            s, l = small[numSmall], large[numLarge]
+            aliasProbs[start + s] = scaled[s]
+            aliasIndices[start + s] = l
+            scaled[l] = (scaled[l] + scaled[s]) - 1.0
+            if scaled[l] < 1.0:
+                small[numSmall] = l
+                numSmall += 1
+            else:
+                large[numLarge] = l
+                numLarge += 1
+
+
+def walkStates(indptr, indices, aliasProbs, aliasIndices, startProbs, startIndices,
+               backoffIndptr, backoffIndices, backoffProbs, backoffAliasIndices,
+               fallbackProbs, fallbackIndices, fallbackStates, state, u, out):
+    """
+    args:
+    indptr, indices, aliasProbs, aliasIndices: Arrays of a TransitionTable.
+    startProbs, startIndices: Arrays of the start AliasTable of the TransitionTable.
+    backoffIndptr, backoffIndices, backoffProbs, backoffAliasIndices: Arrays of the backoff table. (Empty if none)
+    fallbackProbs, fallbackIndices, fallbackStates: Arrays of the fallback AliasTable and its states. (Empty if none)
+    state: Index of the previous state, or -1 to draw a start state.
+    u: Numpy array of random floats between 0 and 1.
+    out: Numpy array of int64, same length as u. The drawn states are written here.
+    return:
+    The last drawn state.
+    ---------------------------------------------------------------------------
+    Draws one state for each float in u, like TransitionTable.walk.
+    """
+    for n in range(len(u)):
+        next = -1
+        if state >= 0:
+            start = indptr[state]
+            k = indptr[state + 1] - start
+            if k > 0:
+                x = u[n] * k
+                j = int(x)
+                if x - j >= aliasProbs[start + j]:
+                    j = aliasIndices[start + j]
+                next = indices[start + j]
+            elif len(backoffIndptr) > 0:
+                start = backoffIndptr[state]
+                k = backoffIndptr[state + 1] - start
+                if k > 0:
+                    x = u[n] * k
+                    j = int(x)
+                    if x - j >= backoffProbs[start + j]:
+                        j = backoffAliasIndices[start + j]
+                    next = backoffIndices[start + j]
+            elif len(fallbackStates) > 0:
+                x = u[n] * len(fallbackProbs)
+                j = int(x)
+                if x - j >= fallbackProbs[j]:
+                    j = fallbackIndices[j]
+                next = fallbackStates[j]
+        if next < 0:
+            x = u[n] * len(startProbs)
+            j = int(x)
+            if x - j < startProbs[j]:
+                next = j
+            else:
+                next = startIndices[j]
+        state = next
+        out[n] = state
+    return state
+
+
+if numba is not None:
+    fillAliasTables = numba.njit(cache=True)(fillAliasTables)
+    walkStates = numba.njit(cache=True)(walkStates)
+
+
+class AliasTable(object):
+    def __init__(self, weights):
+        """
+        args:
+        weights: List or numpy array of non-negative weights. Normalized automatically.
+        ---------------------------------------------------------------------------
+        Constructs an alias table, used to draw indices from weights in constant time.
+        """
+        weights = np.asarray(weights, dtype=np.float64)
+        probs = weights / weights.sum()
+        if backend == 'numba':
+            self.aliasProbs = np.ones(len(probs))
+            self.aliasIndices = np.zeros(len(probs), dtype=np.int32)
+            fillAliasTables(np.array([0, len(probs)], dtype=np.int64), probs, np.zeros(1, dtype=np.int64),
+                            self.aliasProbs, self.aliasIndices)
+        else:
+            aliasProbs, aliasIndices = aliasTable(probs.tolist())
+            self.aliasProbs = np.array(aliasProbs)
+            self.aliasIndices = np.array(aliasIndices, dtype=np.int32)
+
+    @classmethod
+    def fromArrays(cls, aliasProbs, aliasIndices):
+        """
+        args:
+        aliasProbs, aliasIndices: Numpy arrays of an existing alias table. (Used by loadModel)
+        return:
+        AliasTable using the arrays without copying them.
+        """
+        table = cls.__new__(cls)
+        table.aliasProbs = aliasProbs
+        table.aliasIndices = aliasIndices
+        return table
+
+    def draw(self, u):
+        """
+        args:
+        u: Random float between 0 and 1.
+        return:
+        Index drawn with probability proportional to its weight.
+        """
+        x = u * len(self.aliasProbs)
+        k = int(x)
+        if x - k < self.aliasProbs[k]:
+            return k
+        return int(self.aliasIndices[k])
+
+    def drawMany(self, u):
+        """
+        args:
+        u: Numpy array of random floats between 0 and 1.
+        return:
+        Numpy array of indices, one for each element of u. Same results as self.draw for each element.
+        """
+        x = u * len(self.aliasProbs)
+        k = x.astype(np.int64)
+        return np.where(x - k < self.aliasProbs[k], k, self.aliasIndices[k])
+
+
+class TransitionTable(object):
+    # Names of the numpy arrays stored by saveModel.
+    arrayNames = ('indptr', 'indices', 'counts', 'rowTotals', 'probs', 'aliasProbs', 'aliasIndices')
+
+    def __init__(self, rows, cols, counts, numStates):
+        """
+        args:
+        rows: Numpy array of ints. Index of the first state of each pair.
+        cols: Numpy array of ints. Index of the second state of each pair.
+        counts: Numpy array of ints. Number of occurrences of each pair.
+        numStates: Number of states. (Number of words in the vocabulary)
+        ---------------------------------------------------------------------------
+        Constructs a sparse table of transformation-probabilities. (Compressed sparse row format)
+
+        Only pairs that occur in the text are stored, so memory scales with the number of distinct pairs,
+        and not with the number of states squared.
+
+        The successors of state i are self.indices[self.indptr[i]:self.indptr[i+1]],
+        and their probabilities are self.probs[self.indptr[i]:self.indptr[i+1]].
+        """
+        self.setCounts(rows, cols, counts, numStates)
+        # Create an alias table for each state, stored in the same order as self.indices.
+        # aliasIndices are positions within the row of the state.
+        self.aliasProbs = np.ones(len(self.indices))
+        self.aliasIndices = np.zeros(len(self.indices), dtype=np.int32)
+        self.createAliasTables(np.arange(numStates))
+        # Alias table for the first state of a pair. States are weighted by their number of pairs.
+        self.start = AliasTable(self.rowTotals)
+        # Cumulative probabilities used by self.drawNextMany. Created the first time they are needed.
+        self.offsetCumProbs = None
+        # Table of successors for the states without successors. See self.setBackoff.
+        self.backoff = None
+        # Alias table shared by all states without successors, and the states it draws. See self.setFallback.
+        self.fallback = None
+        self.fallbackStates = None
+
+    def setCounts(self, rows, cols, counts, numStates, normalize=True):
+        """
+        args:
+        rows, cols, counts, numStates: See self.__init__.
+        normalize: False to not create self.probs. (LazyTransitionTable) (Defaults to True)
+        ---------------------------------------------------------------------------
+        Creates self.indptr, self.indices, self.counts, self.rowTotals and self.probs from the counts of the pairs.
+        """
+        self.numStates = numStates
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        counts = np.asarray(counts, dtype=np.int64)
+        # Sort pairs by first state, then by second state. (Word-pairs are already sorted)
+        if np.any((rows[1:] < rows[:-1]) | ((rows[1:] == rows[:-1]) & (cols[1:] <= cols[:-1]))):
+            order = np.lexsort((cols, rows))
+            rows, cols, counts = rows[order], cols[order], counts[order]
+        self.indices = cols.astype(np.int32)
+        self.counts = counts
+        # self.indptr[i] is the position of the first successor of state i.
+        self.indptr = np.zeros(numStates + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=numStates), out=self.indptr[1:])
+        # Normalize the counts of each state, so the probabilities of each state accumulate to 1.0.
+        self.rowTotals = np.bincount(rows, weights=self.counts, minlength=numStates)
+        if normalize:
+            self.probs = self.counts / self.rowTotals[rows]
+
+    def createAliasTables(self, states):
+        """
+        args:
+        states: Numpy array of indices of the states to create alias tables for.
+        ---------------------------------------------------------------------------
+        Creates the alias tables of states in self.aliasProbs and self.aliasIndices.
+        States with one successor keep aliasProbs 1.0.
+        """
+        states = states[self.indptr[states + 1] - self.indptr[states] > 1]
+        if backend == 'numba':
+            fillAliasTables(self.indptr, self.probs, states.astype(np.int64), self.aliasProbs, self.aliasIndices)
+            return
+        for i in states:
+            start, stop = self.indptr[i], self.indptr[i + 1]
+            aliasProbs, aliasIndices = aliasTable(self.probs[start:stop].tolist())
+            self.aliasProbs[start:stop] = aliasProbs
+            self.aliasIndices[start:stop] = aliasIndices
+
+    def update(self, rows, cols, counts, numStates, changedStates):
+        """
+        args:
+        rows, cols, counts, numStates: See self.__init__. The counts of all pairs, old and new.
+        changedStates: Numpy array of indices of the states with new counts.
+        ---------------------------------------------------------------------------
+        Updates the table with new counts. Used by AutomaticTextGenerator.update.
+        The probabilities are normalized again with numpy, but only the alias tables of changedStates are created
+        again. The alias tables of the other states are copied to their new positions.
+        The arrays are replaced and not changed, so memory-mapped tables can be updated.
+        """
+        oldIndptr, oldAliasProbs, oldAliasIndices = self.indptr, self.aliasProbs, self.aliasIndices
+        self.setCounts(rows, cols, counts, numStates)
+        self.aliasProbs = np.ones(len(self.indices))
+        self.aliasIndices = np.zeros(len(self.indices), dtype=np.int32)
+        changed = np.zeros(numStates, dtype=bool)
+        changed[changedStates] = True
+        # Copy the alias tables of the unchanged states. Their successors are the same, but may have moved.
+        unchanged = np.flatnonzero(~changed[:len(oldIndptr) - 1])
+        lengths = oldIndptr[unchanged + 1] - oldIndptr[unchanged]
+        within = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        oldPositions = np.repeat(oldIndptr[unchanged], lengths) + within
+        newPositions = np.repeat(self.indptr[unchanged], lengths) + within
+        self.aliasProbs[newPositions] = oldAliasProbs[oldPositions]
+        self.aliasIndices[newPositions] = oldAliasIndices[oldPositions]
+        self.createAliasTables(np.flatnonzero(changed))
+        self.start = AliasTable(self.rowTotals)
+        self.offsetCumProbs = None
+        # Other states may have no successors now. The backoff table must be set again.
+        self.backoff = None
+        self.fallback = None
+        self.fallbackStates = None
+
+    @classmethod
+    def fromArrays(cls, arrays, cacheSize=None):
+        """
+        args:
+        arrays: Dictionary of numpy arrays, created by self.getArrays(). (Used by loadModel)
+        cacheSize: Maximum number of rows kept, if the table was saved by a LazyTransitionTable.
+                (Defaults to None, 2**16 rows)
+        return:
+        TransitionTable (or LazyTransitionTable) using the arrays without copying them.
+        """
+        if cls is TransitionTable and 'aliasProbs' not in arrays:
+            return LazyTransitionTable.fromArrays(arrays, 2**16 if cacheSize is None else cacheSize)
+        table = cls.__new__(cls)
+        for name in cls.arrayNames:
+            setattr(table, name, arrays[name])
+        table.numStates = len(table.indptr) - 1
+        table.start = AliasTable.fromArrays(arrays['startAliasProbs'], arrays['startAliasIndices'])
+        table.offsetCumProbs = None
+        table.backoff = None
+        if 'backoff.indptr' in arrays:
+            table.backoff = TransitionTable.fromArrays(dict((name[len('backoff.'):], array)
+                                                            for name, array in arrays.iteritems()
+                                                            if name.startswith('backoff.')))
+        table.fallback = None
+        table.fallbackStates = None
+        if 'fallbackStates' in arrays:
+            table.fallback = AliasTable.fromArrays(arrays['fallbackAliasProbs'], arrays['fallbackAliasIndices'])
+            table.fallbackStates = arrays['fallbackStates']
+        return table
+
+    def getArrays(self):
+        """
+        return:
+        Dictionary of the numpy arrays in the table. (Used by saveModel)
+        """
+        arrays = dict((name, getattr(self, name)) for name in self.arrayNames)
+        arrays['startAliasProbs'] = self.start.aliasProbs
+        arrays['startAliasIndices'] = self.start.aliasIndices
+        if self.backoff is not None:
+            for name, array in self.backoff.getArrays().iteritems():
+                arrays['backoff.' + name] = array
+        if self.fallback is not None:
+            arrays['fallbackAliasProbs'] = self.fallback.aliasProbs
+            arrays['fallbackAliasIndices'] = self.fallback.aliasIndices
+            arrays['fallbackStates'] = self.fallbackStates
+        return arrays
+
+    def row(self, i):
+        """
+        args:
+        i: Index of state.
+        return:
+        Tuple of numpy arrays. (indices of successors, probabilities of successors)
+        """
+        start, stop = self.indptr[i], self.indptr[i + 1]
+        return self.indices[start:stop], self.probs[start:stop]
+
+    def drawStart(self, u):
+        """
+        args:
+        u: Random float between 0 and 1.
+        return:
+        Index of a state, drawn with probability proportional to the number of pairs starting with that state.
+        """
+        return self.start.draw(u)
+
+    def drawNext(self, i, u):
+        """
+        args:
+        i: Index of previous state.
+        u: Random float between 0 and 1.
+        return:
+        Index of a successor of state i, drawn in constant time with its transformation-probability.
+        If state i has no successors, a state is drawn from self.backoff (or self.fallback) instead.
+        -1 if there is neither.
+        """
+        start = self.indptr[i]
+        k = self.indptr[i + 1] - start
+        if k == 0:
+            if self.backoff is not None:
+                return self.backoff.drawNext(i, u)
+            if self.fallback is not None:
+                return int(self.fallbackStates[self.fallback.draw(u)])
+            return -1
+        x = u * k
+        j = int(x)
+        if x - j >= self.aliasProbs[start + j]:
+            j = self.aliasIndices[start + j]
+        return int(self.indices[start + j])
+
+    def drawStartMany(self, u):
+        """
+        args:
+        u: Numpy array of random floats between 0 and 1.
+        return:
+        Numpy array of start states, one for each float in u. (Vectorised self.drawStart)
+        """
+        return self.start.drawMany(u)
+
+    def drawNextMany(self, states, u):
+        """
+        args:
+        states: Numpy array of indices of previous states.
+        u: Numpy array of random floats between 0 and 1, one for each state.
+        return:
+        Numpy array of successors, one for each state. Drawn from self.backoff (or self.fallback) where a state
+        has no successors, or -1 if there is neither.
+        ---------------------------------------------------------------------------
+        Draws a successor for many states at once with one vectorised searchsorted.
+        The cumulative probabilities of row i are offset by i, so all rows are stored in one increasing array,
+        and the successor of state i is found by searching for i + u.
+        """
+        if self.offsetCumProbs is None:
+            rows = np.repeat(np.arange(self.numStates), np.diff(self.indptr))
+            cumProbs = np.cumsum(self.probs)
+            # Subtract the cumulative sum of the previous rows, so each row accumulates from 0 to 1.
+            rowStarts = np.concatenate(([0.0], cumProbs))[self.indptr[:-1]]
+            self.offsetCumProbs = cumProbs - rowStarts[rows] + rows
+        states = np.asarray(states, dtype=np.int64)
+        start, stop = self.indptr[states], self.indptr[states + 1]
+        pos = np.searchsorted(self.offsetCumProbs, states + u, side='right')
+        # Rounding errors may move the position out of the row. Clip it to the last successor.
+        pos = np.minimum(np.maximum(pos, start), stop - 1)
+        successors = np.where(stop > start, self.indices[np.maximum(pos, 0)], -1)
+        dead = np.flatnonzero(stop == start)
+        if len(dead) and self.backoff is not None:
+            successors[dead] = self.backoff.drawNextMany(states[dead], u[dead])
+        elif len(dead) and self.fallback is not None:
+            successors[dead] = self.fallbackStates[self.fallback.drawMany(u[dead])]
+        return successors
+
+    def walk(self, state, u):
+        """
+        args:
+        state: Index of the previous state, or -1 to start with a state drawn by self.drawStart.
+        u: Numpy array of random floats between 0 and 1.
+        return:
+        Numpy array of int64. One state for each float in u, each drawn with self.drawNext from the state before.
+        ---------------------------------------------------------------------------
+        Walks through len(u) states. A state without successors (and no backoff or fallback) is followed by
+        a start state.
+        Compiled with numba if it is installed. (See walkStates)
+        """
+        u = np.asarray(u, dtype=np.float64)
+        if backend == 'numba':
+            out = np.empty(len(u), dtype=np.int64)
+            backoff = self.backoff
+            if backoff is None:
+                backoffArrays = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int32),
+                                 np.zeros(0), np.zeros(0, dtype=np.int32))
+            else:
+                backoffArrays = (np.asarray(backoff.indptr), np.asarray(backoff.indices),
+                                 np.asarray(backoff.aliasProbs), np.asarray(backoff.aliasIndices))
+            if self.fallback is None:
+                fallbackArrays = (np.zeros(0), np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int64))
+            else:
+                fallbackArrays = (np.asarray(self.fallback.aliasProbs), np.asarray(self.fallback.aliasIndices),
+                                  np.asarray(self.fallbackStates))
+            walkStates(np.asarray(self.indptr), np.asarray(self.indices), np.asarray(self.aliasProbs),
+                       np.asarray(self.aliasIndices), np.asarray(self.start.aliasProbs),
+                       np.asarray(self.start.aliasIndices), backoffArrays[0], backoffArrays[1],
+                       backoffArrays[2], backoffArrays[3], fallbackArrays[0], fallbackArrays[1],
+                       fallbackArrays[2], state, u, out)
+            return out
+        out = []
+        for x in u.tolist():
+            if state >= 0:
+                state = self.drawNext(state, x)
+            if state < 0:
+                state = self.drawStart(x)
+            out.append(state)
+        return np.array(out, dtype=np.int64)
+
+    def deadEnds(self):
+        """
+        return:
+        Numpy array of the indices of the states without successors, which are the successor of a state.
+        (Other states without successors are never reached. For example words removed by prunePairs)
+        """
+        reached = np.zeros(self.numStates, dtype=bool)
+        reached[self.indices] = True
+        return np.flatnonzero((np.diff(self.indptr) == 0) & reached)
+
+    def setBackoff(self, rows, cols, counts):
+        """
+        args:
+        rows: Numpy array of ints. Index of each state without successors. (See self.deadEnds)
+        cols: Numpy array of ints. Index of a state to back off to.
+        counts: Numpy array of ints. Weight of each state to back off to.
+        ---------------------------------------------------------------------------
+        Creates self.backoff, a table with the states to continue from, when a state has no successors.
+        The probabilities and alias tables of the backoff table are computed once, here,
+        so self.drawNext and self.drawNextMany never have to stop or start again at a state without successors.
+        """
+        self.backoff = TransitionTable(rows, cols, counts, self.numStates) if len(rows) else None
+
+    def setFallback(self, states, weights):
+        """
+        args:
+        states: Numpy array of ints. Index of each state to fall back to.
+        weights: Numpy array of ints. Weight of each state to fall back to.
+        ---------------------------------------------------------------------------
+        Creates self.fallback, one alias table shared by all states without successors (see self.deadEnds),
+        for tables where every state without successors continues from the same states.
+        It is stored once, so its size is len(states), and not the number of dead ends times len(states)
+        as with self.setBackoff. Used when there is no backoff table.
+        """
+        self.fallbackStates = np.asarray(states, dtype=np.int64)
+        self.fallback = AliasTable(weights) if len(self.fallbackStates) else None
+
+    def nnz(self):
+        """
+        return:
+        Number of stored pairs.
+        """
+        return len(self.indices)
+
+    def toDense(self):
+        """
+        return:
+        Dense numpy array of size numStates x numStates. Only use this for small tables. (Plotting)
+        """
+        dense = np.zeros((self.numStates, self.numStates))
+        rows = np.repeat(np.arange(self.numStates), np.diff(self.indptr))
+        dense[rows, self.indices] = self.counts / self.rowTotals[rows]
+        return dense
+
+    def toBlocks(self, pixels=512, order=None):
+        """
+        args:
+        pixels: Maximum number of blocks along each axis. (Defaults to 512)
+        order: Numpy array of the states, ranked. (Defaults to None, the order of the states)
+                * For example the states sorted by descending frequency, so the frequent states get their own blocks.
+        return:
+        Dense numpy array of size numBlocks x numBlocks, where numBlocks is min(pixels, self.numStates).
+        ---------------------------------------------------------------------------
+        Reduces the table to blocks of states that are next to each other in order. (Plotting)
+        Block (a, b) is the probability that a state in block a is followed by a state in block b,
+        so each row of blocks accumulates to 1.0, like the rows of the table.
+        Only the stored pairs are read, so memory and time do not depend on numStates squared.
+        If numStates <= pixels, each state is a block, and the blocks are the probabilities of the table.
+        """
+        numBlocks = min(pixels, self.numStates)
+        blocks = np.zeros((numBlocks, numBlocks))
+        if numBlocks == 0:
+            return blocks
+        # Find the rank of each state, and the block of each rank. Blocks have the same number of states (+/- 1).
+        ranks = np.arange(self.numStates)
+        if order is not None:
+            ranks[order] = np.arange(self.numStates)
+        stateBlocks = ranks * numBlocks // self.numStates
+        rows = np.repeat(stateBlocks, np.diff(self.indptr))
+        cols = stateBlocks[self.indices]
+        # Add the counts of the pairs in each block, and normalize each row of blocks.
+        blocks += np.bincount(rows * numBlocks + cols, weights=self.counts,
+                              minlength=numBlocks ** 2).reshape(numBlocks, numBlocks)
+        blocks /= np.maximum(blocks.sum(axis=1), 1)[:, np.newaxis]
+        return blocks
+
+
+class LazyTransitionTable(TransitionTable):
+    # Names of the numpy arrays stored by saveModel. Rows are created again when they are used.
+    arrayNames = ('indptr', 'indices', 'counts', 'rowTotals')
+
+    def __init__(self, rows, cols, counts, numStates, cacheSize=2**16):
+        """
+        args:
+        rows, cols, counts, numStates: See TransitionTable.__init__.
+        cacheSize: Maximum number of rows kept in self.cache. (Defaults to 2**16)
+        ---------------------------------------------------------------------------
+        Constructs a sparse table of transformation-probabilities, which only stores the counts of the pairs.
+
+        The cumulative probabilities of a row are created the first time a successor of the state is drawn,
+        and kept in self.cache. When the cache is full, the least recently used row is removed.
+        Generating a text only visits a small part of the states, so no time is spent on rows that are never used,
+        and the memory of the rows is at most cacheSize rows.
+
+        Draws have the same probabilities as TransitionTable, but are found by binary search in the row
+        instead of an alias table, so the same random numbers give other states.
+        """
+        self.setCounts(rows, cols, counts, numStates, normalize=False)
+        self.start = AliasTable(self.rowTotals)
+        self.backoff = None
+        self.fallback = None
+        self.fallbackStates = None
+        self.createCache(cacheSize)
+
+    def createCache(self, cacheSize):
+        """
+        args:
+        cacheSize: Maximum number of rows kept in self.cache.
+        ---------------------------------------------------------------------------
+        Creates an empty cache, and sets the hits, misses and evictions of the cache to 0.
+        """
+        self.cacheSize = cacheSize
+        # Ordered by use. The least recently used row is first.
+        self.cache = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def cacheInfo(self):
+        """
+        return:
+        Dictionary of the size, maximum size, hits, misses and evictions of self.cache.
+        """
+        return {'size': len(self.cache), 'cacheSize': self.cacheSize, 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions}
+
+    def cumProbs(self, i):
+        """
+        args:
+        i: Index of a state with successors.
+        return:
+        Numpy array of the cumulative probabilities of the successors of state i. (The last is 1.0)
+        """
+        cumProbs = self.cache.pop(i, None)
+        if cumProbs is None:
+            self.misses += 1
+            start, stop = self.indptr[i], self.indptr[i + 1]
+            cumProbs = np.cumsum(self.counts[start:stop]) / self.rowTotals[i]
+            if self.cacheSize <= 0:
+                return cumProbs
+            if len(self.cache) >= self.cacheSize:
+                self.cache.popitem(last=False)
+                self.evictions += 1
+        else:
+            self.hits += 1
+        # Insert the row again, so it is the most recently used.
+        self.cache[i] = cumProbs
+        return cumProbs
+
+    def update(self, rows, cols, counts, numStates, changedStates):
+        """
+        args:
+        rows, cols, counts, numStates, changedStates: See TransitionTable.update.
+        ---------------------------------------------------------------------------
+        Updates the table with new counts. Only the rows of changedStates are removed from self.cache.
+        """
+        self.setCounts(rows, cols, counts, numStates, normalize=False)
+        for i in np.asarray(changedStates).tolist():
+            self.cache.pop(i, None)
+        self.start = AliasTable(self.rowTotals)
+        self.backoff = None
+        self.fallback = None
+        self.fallbackStates = None
+
+    @classmethod
+    def fromArrays(cls, arrays, cacheSize=2**16):
+        """
+        args:
+        arrays: Dictionary of numpy arrays, created by self.getArrays(). (Used by loadModel)
+        cacheSize: Maximum number of rows kept in self.cache. (Defaults to 2**16)
+        return:
+        LazyTransitionTable using the arrays without copying them.
+        """
+        table = super(LazyTransitionTable, cls).fromArrays(arrays)
+        table.createCache(cacheSize)
+        return table
+
+    def row(self, i):
+        """
+        args:
+        i: Index of state.
+        return:
+        Tuple of numpy arrays. (indices of successors, probabilities of successors)
+        """
+        start, stop = self.indptr[i], self.indptr[i + 1]
+        return self.indices[start:stop], self.counts[start:stop] / self.rowTotals[i]
+
+    def drawNext(self, i, u):
+        """
+        args:
+        i: Index of previous state.
+        u: Random float between 0 and 1.
+        return:
+        Index of a successor of state i, drawn with its transformation-probability. (See TransitionTable.drawNext)
+        """
+        start = self.indptr[i]
+        k = self.indptr[i + 1] - start
+        if k == 0:
+            if self.backoff is not None:
+                return self.backoff.drawNext(i, u)
+            if self.fallback is not None:
+                return int(self.fallbackStates[self.fallback.draw(u)])
+            return -1
+        # Rounding errors may give a position after the last successor. Clip it to the last successor.
+        j = min(np.searchsorted(self.cumProbs(i), u, side='right'), k - 1)
+        return int(self.indices[start + j])
+
+    def drawNextMany(self, states, u):
+        """
+        args:
+        states, u: See TransitionTable.drawNextMany.
+        return:
+        Numpy array of successors, one for each state. (See TransitionTable.drawNextMany)
+        ---------------------------------------------------------------------------
+        The floats of each distinct state are searched for in the row of the state at once.
+        """
+        states = np.asarray(states, dtype=np.int64)
+        successors = np.full(len(states), -1, dtype=np.int64)
+        distinct, inverse = np.unique(states, return_inverse=True)
+        # Positions in states of each distinct state.
+        positions = np.split(np.argsort(inverse, kind='mergesort'), np.cumsum(np.bincount(inverse))[:-1])
+        for i, n in zip(distinct.tolist(), positions):
+            start, stop = self.indptr[i], self.indptr[i + 1]
+            if stop > start:
+                j = np.minimum(np.searchsorted(self.cumProbs(i), u[n], side='right'), stop - start - 1)
+                successors[n] = self.indices[start + j]
+            elif self.backoff is not None:
+                successors[n] = self.backoff.drawNextMany(states[n], u[n])
+            elif self.fallback is not None:
+                successors[n] = self.fallbackStates[self.fallback.drawMany(u[n])]
+        return successors
+
+    def walk(self, state, u):
+        """
+        args:
+        state, u: See TransitionTable.walk.
+        return:
+        Numpy array of int64. One state for each float in u. (See TransitionTable.walk)
+        ---------------------------------------------------------------------------
+        Always walks with self.drawNext, since the numba kernel needs the alias tables of all rows.
+        """
+        out = []
+        for x in np.asarray(u, dtype=np.float64).tolist():
+            if state >= 0:
+                state = self.drawNext(state, x)
+            if state < 0:
+                state = self.drawStart(x)
+            out.append(state)
+        return np.array(out, dtype=np.int64)
+
+
+def createTransitionTable(rows, cols, counts, numStates, cacheSize=None):
+    """
+    args:
+    rows, cols, counts, numStates: See TransitionTable.__init__.
+    cacheSize: None to create all rows now. (TransitionTable)
+            An int to create rows when they are used, and keep at most cacheSize rows. (LazyTransitionTable)
+    return:
+    TransitionTable or LazyTransitionTable.
+    """
+    if cacheSize is None:
+        return TransitionTable(rows, cols, counts, numStates)
+    return LazyTransitionTable(rows, cols, counts, numStates, cacheSize)
+
+
+def prunePairs(rows, cols, counts, numStates, keepStates=None, minPairCount=1, topK=None):
+    """
+    args:
+    rows, cols, counts, numStates: Pairs of states. See TransitionTable.__init__.
+    keepStates: Numpy array of bools, or None to keep all states. States that are False are removed where possible.
+    minPairCount: Pairs with a lower count are removed. (Defaults to 1)
+    topK: Maximum number of successors kept for each state, or None to keep all. (Defaults to None)
+    return:
+    Tuple (rows, cols, counts, stats). The pairs that are kept, and a dictionary of the numbers kept and removed.
+    ---------------------------------------------------------------------------
+    Removes the rare pairs of a table, before it is created. The table normalizes the rows of the kept pairs again.
+    The successors of each state are ranked, successors in keepStates first, then by count and then by index.
+    The first successor is always kept, so pruning does not create new states without successors.
+    The other successors are kept if they are in keepStates, have at least minPairCount, and are in the topK.
+    Pairs starting with a removed state are removed, if no kept pair leads to the state.
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    cols = np.asarray(cols, dtype=np.int64)
+    counts = np.asarray(counts, dtype=np.int64)
+    keep = np.ones(len(rows), dtype=bool)
+    if keepStates is not None or minPairCount > 1 or topK is not None:
+        kept = np.ones(len(rows), dtype=bool) if keepStates is None else keepStates[cols]
+        order = np.lexsort((cols, -counts, ~kept, rows))
+        sortedRows = rows[order]
+        ranks = np.empty(len(rows), dtype=np.int64)
+        ranks[order] = np.arange(len(rows)) - np.searchsorted(sortedRows, sortedRows)
+        keep = (kept & (counts >= minPairCount)) | (ranks == 0)
+        if topK is not None:
+            keep &= ranks < topK
+        if keepStates is not None:
+            # Removed states which are not reached by a kept pair are never visited. Their pairs are removed.
+            reached = np.zeros(numStates, dtype=bool)
+            reached[cols[keep]] = True
+            keep &= keepStates[rows] | reached[rows]
+    hasPairs = np.zeros(numStates, dtype=bool)
+    hasPairs[rows] = True
+    keptStates = np.zeros(numStates, dtype=bool)
+    keptStates[rows[keep]] = True
+    stats = {'states': int(hasPairs.sum()), 'keptStates': int(keptStates.sum()),
+             'pairs': len(rows), 'keptPairs': int(keep.sum()),
+             'pairCount': int(counts.sum()), 'keptPairCount': int(counts[keep].sum())}
+    return rows[keep], cols[keep], counts[keep], stats
+
+
+def changedRows(oldKeys, oldCounts, keys, counts):
+    """
+    args:
+    oldKeys: Sorted numpy array of pairs (first * 2**32 + second), before new counts were added.
+    oldCounts: Numpy array of the count of each key in oldKeys.
+    keys: Sorted numpy array of pairs, after new counts were added. Contains all of oldKeys.
+    counts: Numpy array of the count of each key in keys.
+    return:
+    Sorted numpy array of the first states of the pairs which are new or have new counts.
+    """
+    changed = np.ones(len(keys), dtype=bool)
+    positions = np.searchsorted(keys, oldKeys)
+    changed[positions] = counts[positions] != oldCounts
+    return np.unique(keys[changed] >> 32)
+
+
+class ContextStore(object):
+    # Names of the numpy arrays stored by saveModel.
+    arrayNames = ('contexts', 'pairKeys', 'pairCounts')
+
+    def __init__(self, order, cacheSize=None):
+        """
+        args:
+        order: Number of tokens (symbols or words) in each context.
+        cacheSize: None, or maximum number of rows of self.transitions to keep. (See createTransitionTable)
+        ---------------------------------------------------------------------------
+        Constructs a table of the contexts of a text, and the counts of the transitions between them.
+        Used by models 2 and 3 when the object has order > 1.
+
+        A context is a sequence of order tokens, stored as a row of token indices in self.contexts.
+        Only contexts that occur in the text get a row. The rows are found by binary search in self.sortedRows,
+        the rows of self.contexts viewed as single elements and sorted, so each chunk of text is looked up with numpy.
+        So memory grows with the number of distinct contexts, and not with the number of tokens to the power of order.
+
+        Context i is followed by context j when j is i without its first token and with one new token,
+        so the transitions between contexts form a table like the pairs of model 2 and 3. (See TransitionTable)
+        A walk through the contexts yields all tokens of the first context, and then the last token of each context.
+        So the tokens of a context without successors are yielded before backing off to another context.
+        A context drawn from the backoff table yields its tokens after the ones it shares with the context before.
+        (See self.createBackoff and self.walkTokens)
+        """
+        self.order = order
+        self.cacheSize = cacheSize
+        self.contexts = np.zeros((0, order), dtype=np.int32)
+        # self.sortedRows[n] is the context with index self.sortedIds[n].
+        self.sortedRows = self.rowView(self.contexts)
+        self.sortedIds = np.zeros(0, dtype=np.int64)
+        # Transitions are stored as ints (context * 2**32 + next context) like word-pairs.
+        self.pairKeys = np.zeros(0, dtype=np.int64)
+        self.pairCounts = np.zeros(0, dtype=np.int64)
+        self.newPairKeys = []
+        # The last tokens counted. The next tokens continue from these.
+        self.lastTokens = np.zeros(0, dtype=np.int64)
+        self.transitions = None
+        # self.firstTokens[i] is the position of the first token yielded by the context drawn after context i.
+        self.firstTokens = None
+
+    @classmethod
+    def fromArrays(cls, order, arrays, cacheSize=None):
+        """
+        args:
+        order: Number of tokens in each context.
+        cacheSize: See self.__init__.
+        arrays: Dictionary of numpy arrays, created by self.getArrays(). (Used by loadModel)
+        return:
+        ContextStore using the arrays without copying them. self.sortedRows is created if more tokens are counted.
+        """
+        store = cls(order, cacheSize)
+        for name in cls.arrayNames:
+            setattr(store, name, arrays[name])
+        store.sortedRows = None
+        if 'transitions.indptr' in arrays:
+            store.transitions = TransitionTable.fromArrays(dict((name[len('transitions.'):], array)
+                                                                for name, array in arrays.iteritems()
+                                                                if name.startswith('transitions.')), cacheSize)
+            store.firstTokens = arrays['firstTokens']
+        return store
+
+    def getArrays(self):
+        """
+        return:
+        Dictionary of the numpy arrays in the store, and in its transition table. (Used by saveModel)
+        """
+        self.consolidate()
+        arrays = dict((name, getattr(self, name)) for name in self.arrayNames)
+        if self.transitions is not None:
+            for name, array in self.transitions.getArrays().iteritems():
+                arrays['transitions.' + name] = array
+            arrays['firstTokens'] = self.firstTokens
+        return arrays
+
+    def __len__(self):
+        return len(self.contexts)
+
+    def rowView(self, contexts):
+        """
+        args:
+        contexts: Numpy array of int32 contexts, one in each row.
+        return:
+        Numpy array with each row of contexts as one element, which can be sorted and compared.
+        """
+        contexts = np.ascontiguousarray(contexts, dtype=np.int32)
+        return contexts.view(np.dtype((np.void, 4 * self.order))).ravel()
+
+    def countTokens(self, tokens):
+        """
+        args:
+        tokens: Numpy array or list of token indices, in the order they occur in the text.
+        ---------------------------------------------------------------------------
+        Counts up the transitions between the contexts of tokens, continuing from self.lastTokens.
+        """
+        k = self.order
+        tokens = np.concatenate((self.lastTokens, np.asarray(tokens, dtype=np.int64)))
+        self.lastTokens = tokens[-k:]
+        if len(tokens) <= k:
+            return
+        # Row n of windows is the context starting at token n. (No copy is made)
+        windows = np.lib.stride_tricks.as_strided(tokens, shape=(len(tokens) - k + 1, k),
+                                                  strides=(tokens.strides[0], tokens.strides[0]))
+        contextIds = self.getContextIds(windows)
+        self.newPairKeys.append((contextIds[:-1] << 32) | contextIds[1:])
+        # Count up the stored transitions, when there are more stored transitions than counted transitions.
+        if sum(len(keys) for keys in self.newPairKeys) > max(len(self.pairKeys), 2**20):
+            self.consolidate()
+
+    def getContextIds(self, windows):
+        """
+        args:
+        windows: Numpy array of contexts, one in each row.
+        return:
+        Numpy array of int64. The index of each context. New contexts get the next index.
+        """
+        if self.sortedRows is None:
+            # Contexts were loaded by loadModel. Sort them, to add new contexts.
+            order = np.argsort(self.rowView(self.contexts), kind='mergesort')
+            self.sortedRows, self.sortedIds = self.rowView(self.contexts)[order], order.astype(np.int64)
+        # Look up the distinct contexts only.
+        rows, inverse = np.unique(self.rowView(windows), return_inverse=True)
+        positions = np.searchsorted(self.sortedRows, rows)
+        found = positions < len(self.sortedRows)
+        found[found] = self.sortedRows[positions[found]] == rows[found]
+        uniqueIds = np.empty(len(rows), dtype=np.int64)
+        uniqueIds[found] = self.sortedIds[positions[found]]
+        # Give the new contexts the next indices, and insert them in the sorted rows.
+        new = ~found
+        uniqueIds[new] = np.arange(len(self.contexts), len(self.contexts) + new.sum())
+        self.contexts = np.concatenate((self.contexts, rows[new].view(np.int32).reshape(-1, self.order)))
+        self.sortedRows = np.insert(self.sortedRows, positions[new], rows[new])
+        self.sortedIds = np.insert(self.sortedIds, positions[new], uniqueIds[new])
+        return uniqueIds[inverse]
+
+    def consolidate(self):
+        """
+        Counts up the transitions stored in self.newPairKeys like AutomaticTextGenerator.consolidateWordPairs.
+        """
+        if not self.newPairKeys:
+            return
+        keys = np.concatenate([self.pairKeys] + self.newPairKeys)
+        counts = np.concatenate([self.pairCounts] + [np.ones(len(newKeys), dtype=np.int64)
+                                                     for newKeys in self.newPairKeys])
+        self.pairKeys, inverse = np.unique(keys, return_inverse=True)
+        self.pairCounts = np.bincount(inverse, weights=counts).astype(np.int64)
+        self.newPairKeys = []
+
+    def createTransitions(self, keepTokens=None, minPairCount=1, topK=None):
+        """
+        args:
+        keepTokens: Numpy array of bools, or None. Contexts with a token that is False are removed. (See prunePairs)
+        minPairCount, topK: See prunePairs.
+        return:
+        Dictionary of the numbers of contexts and transitions kept and removed. (See prunePairs)
+        ---------------------------------------------------------------------------
+        Creates self.transitions, the table of transformation-probabilities between contexts.
+        """
+        self.consolidate()
+        keepStates = None if keepTokens is None else keepTokens[self.contexts].all(axis=1)
+        rows, cols, counts, stats = prunePairs(self.pairKeys >> 32, self.pairKeys & 0xFFFFFFFF, self.pairCounts,
+                                               len(self), keepStates, minPairCount, topK)
+        self.transitions = createTransitionTable(rows, cols, counts, len(self), self.cacheSize)
+        self.createBackoff()
+        return stats
+
+    def updateTransitions(self, oldKeys, oldCounts):
+        """
+        args:
+        oldKeys: self.pairKeys before the new tokens were counted.
+        oldCounts: self.pairCounts before the new tokens were counted.
+        ---------------------------------------------------------------------------
+        Updates self.transitions with the new counts. Only contexts with new transitions get new alias tables.
+        """
+        self.consolidate()
+        self.transitions.update(self.pairKeys >> 32, self.pairKeys & 0xFFFFFFFF, self.pairCounts, len(self),
+                                changedRows(oldKeys, oldCounts, self.pairKeys, self.pairCounts))
+        self.createBackoff()
+
+    def createBackoff(self):
+        """
+        Sets the backoff table of self.transitions. A context without successors backs off to the contexts
+        which start with its last order-1 tokens, so the text continues without a break.
+        If there are none, it backs off to shorter and shorter suffixes, and at last to all contexts.
+        The contexts are weighted by their number of successors, and only contexts with successors are used.
+        A context backed off to with a suffix of j tokens yields its tokens from position j, so no token is skipped,
+        and every pair of yielded tokens occurs in the text. (Stored in self.firstTokens)
+        With j = 0 the text starts again with a whole context.
+        """
+        table = self.transitions
+        hasSuccessors = table.rowTotals > 0
+        self.firstTokens = np.full(len(self), self.order - 1, dtype=np.int32)
+        rows, cols = [], []
+        for i in table.deadEnds().tolist():
+            context = self.contexts[i]
+            for j in range(self.order - 1, -1, -1):
+                # Contexts whose first j tokens are the last j tokens of context. (All contexts when j is 0)
+                matches = np.all(self.contexts[:, :j] == context[self.order - j:], axis=1) & hasSuccessors
+                targets = np.flatnonzero(matches)
+                if len(targets):
+                    break
+            self.firstTokens[i] = j
+            rows.append(np.full(len(targets), i, dtype=np.int64))
+            cols.append(targets)
+        if rows:
+            cols = np.concatenate(cols)
+            table.setBackoff(np.concatenate(rows), cols, table.rowTotals[cols].astype(np.int64))
+
+    def walkTokens(self, previous, states):
+        """
+        args:
+        previous: Numpy array of the context before each state, or -1 before the first context.
+        states: Numpy array of contexts drawn by a walk through self.transitions.
+        return:
+        Numpy array of int64. The indices of the tokens yielded by the states, in order.
+        ---------------------------------------------------------------------------
+        Each context yields its tokens from position self.firstTokens[previous]. (Usually only its last token)
+        The first context yields all its tokens.
+        """
+        previous = np.asarray(previous, dtype=np.int64)
+        states = np.asarray(states, dtype=np.int64)
+        firsts = np.where(previous >= 0, self.firstTokens[np.maximum(previous, 0)], 0).astype(np.int64)
+        lengths = self.order - firsts
+        within = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        return self.contexts.ravel()[np.repeat(states * self.order + firsts, lengths) + within].astype(np.int64)
+
+
+class PairSketch(object):
+    # Names of the numpy arrays stored by saveModel.
+    arrayNames = ('table', 'hashA', 'hashB', 'keys', 'counts', 'errors')
+
+    def __init__(self, width=2**20, depth=4, capacity=2**18, seed=0):
+        """
+        args:
+        width: Number of counters in each row of the Count-Min sketch. Rounded up to a power of 2. (Defaults to 2**20)
+        depth: Number of rows (hash functions) of the Count-Min sketch. (Defaults to 4)
+        capacity: Number of pairs kept in the heavy-hitter table. (Defaults to 2**18)
+        seed: Seed of the hash functions. (Defaults to 0)
+        ---------------------------------------------------------------------------
+        Constructs an approximate counter of word-pairs (keys), with memory fixed by width, depth and capacity.
+        Used by AutomaticTextGenerator instead of counting every distinct word-pair.
+        (See AutomaticTextGenerator.__init__)
+
+        The Count-Min sketch adds the count of a key to one counter in each row. The count of a key is estimated
+        by the lowest of its counters. The estimate is never too low, and with probability 1 - exp(-depth)
+        it is at most e / width * total too high, where total is the sum of all counts.
+
+        The heavy-hitter table keeps the capacity most frequent keys. (Space-Saving, updated one batch at a time)
+        A new key gets the count of the keys that were removed (self.floor) added to its count, and self.floor
+        as its error, so the count in the table is never too low, and the count minus the error is never too high.
+        The counts of the kept keys are the lowest of the table count and the sketch estimate.
+        """
+        self.width = 1 << max(int(np.ceil(np.log2(width))), 0)
+        self.depth = depth
+        self.capacity = capacity
+        # Multiply-shift hash functions. hashA is odd, so each key is spread over the whole row.
+        rng = np.random.RandomState(seed)
+        self.hashA = rng.randint(0, 2**62, size=depth).astype(np.uint64) * np.uint64(2) + np.uint64(1)
+        self.hashB = rng.randint(0, 2**62, size=depth).astype(np.uint64)
+        self.reset()
+
+    def reset(self):
+        """
+        Sets all counts to 0.
+        """
+        self.table = np.zeros((self.depth, self.width), dtype=np.int64)
+        # Heavy hitters, sorted by key.
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.errors = np.zeros(0, dtype=np.int64)
+        # Every key not in self.keys has occurred at most self.floor times.
+        self.floor = 0
+        self.total = 0
+
+    def hash(self, keys):
+        """
+        args:
+        keys: Numpy array of int64.
+        return:
+        Numpy array of size depth x len(keys). The position of each key in each row of self.table.
+        """
+        shift = np.uint64(64 - int(np.log2(self.width)))
+        keys = keys.astype(np.uint64)
+        with np.errstate(over='ignore'):
+            return ((self.hashA[:, np.newaxis] * keys + self.hashB[:, np.newaxis]) >> shift).astype(np.int64)
+
+    def add(self, keys, counts=None):
+        """
+        args:
+        keys: Numpy array of int64. Word-pairs created by AutomaticTextGenerator.wordPairKey.
+        counts: Numpy array of the count of each key. (Defaults to None, 1 for each key)
+        ---------------------------------------------------------------------------
+        Adds the counts of a batch of keys to the sketch and the heavy-hitter table.
+        """
+        keys, inverse = np.unique(np.asarray(keys, dtype=np.int64), return_inverse=True)
+        if len(keys) == 0:
+            return
+        counts = np.bincount(inverse, weights=None if counts is None else counts).astype(np.int64)
+        self.total += int(counts.sum())
+        # Count-Min sketch. Keys with the same position in a row are added up first.
+        for d, positions in enumerate(self.hash(keys)):
+            positions, inverse = np.unique(positions, return_inverse=True)
+            self.table[d, positions] += np.bincount(inverse, weights=counts).astype(np.int64)
+        # Heavy hitters. Keys in the table are counted up. New keys start from self.floor.
+        pos = np.minimum(np.searchsorted(self.keys, keys), max(len(self.keys) - 1, 0))
+        kept = (self.keys[pos] == keys) if len(self.keys) else np.zeros(len(keys), dtype=bool)
+        self.counts[pos[kept]] += counts[kept]
+        newKeys = keys[~kept]
+        allKeys = np.concatenate((self.keys, newKeys))
+        allCounts = np.concatenate((self.counts, counts[~kept] + self.floor))
+        allErrors = np.concatenate((self.errors, np.full(len(newKeys), self.floor, dtype=np.int64)))
+        if len(allKeys) > self.capacity:
+            # Keep the capacity highest counts. Removed keys have occurred at most as often as the highest removed.
+            order = np.argsort(-allCounts, kind='mergesort')
+            self.floor = max(self.floor, int(allCounts[order[self.capacity]]))
+            order = np.sort(order[:self.capacity])
+            allKeys, allCounts, allErrors = allKeys[order], allCounts[order], allErrors[order]
+        order = np.argsort(allKeys)
+        self.keys, self.counts, self.errors = allKeys[order], allCounts[order], allErrors[order]
+
+    def estimate(self, keys):
+        """
+        args:
+        keys: Numpy array of int64.
+        return:
+        Numpy array of the Count-Min estimate of the count of each key. (Never too low)
+        """
+        positions = self.hash(np.asarray(keys, dtype=np.int64))
+        return self.table[np.arange(self.depth)[:, np.newaxis], positions].min(axis=0)
+
+    def getPairs(self):
+        """
+        return:
+        Tuple of numpy arrays (keys, counts). The heavy hitters, sorted by key, and their estimated counts.
+        """
+        return self.keys, np.minimum(self.counts, self.estimate(self.keys))
+
+    def errorBounds(self):
+        """
+        return:
+        Dictionary of the error bounds of the counts, and the memory used:
+            - total: Sum of all counts added.
+            - epsilon, delta: Count-Min estimates are at most epsilon * total too high, with probability 1 - delta.
+            - maxOverestimate: epsilon * total.
+            - floor: Highest count a pair can have, and not be in the heavy-hitter table. (At most total / capacity)
+            - maxTableError: Highest error of a count in the heavy-hitter table.
+            - memoryBytes: Memory of the sketch and the heavy-hitter table. (Fixed by width, depth and capacity)
+        """
+        epsilon = np.e / self.width
+        return {'total': self.total, 'epsilon': epsilon, 'delta': np.exp(-self.depth),
+                'maxOverestimate': epsilon * self.total, 'floor': self.floor,
+                'maxTableError': int(self.errors.max()) if len(self.errors) else 0,
+                'memoryBytes': self.table.nbytes + self.capacity * 3 * 8}
+
+    @classmethod
+    def fromArrays(cls, arrays, info):
+        """
+        args:
+        arrays: Dictionary of numpy arrays, created by self.getArrays(). (Used by loadModel)
+        info: Dictionary created by self.getInfo().
+        return:
+        PairSketch with copies of the arrays. (The counts are changed when more text is fed)
+        """
+        sketch = cls.__new__(cls)
+        for name in cls.arrayNames:
+            setattr(sketch, name, np.array(arrays[name]))
+        for name, value in info.iteritems():
+            setattr(sketch, name, value)
+        return sketch
+
+    def getArrays(self):
+        """
+        return:
+        Dictionary of the numpy arrays of the sketch. (Used by saveModel)
+        """
+        return dict((name, getattr(self, name)) for name in self.arrayNames)
+
+    def getInfo(self):
+        """
+        return:
+        Dictionary of the settings and totals of the sketch. (Saved as JSON by saveModel)
+        """
+        return {'width': self.width, 'depth': self.depth, 'capacity': self.capacity, 'floor': self.floor,
+                'total': self.total}
+
+
+class StoredVocabulary(object):
+    def __init__(self, data, offsets):
+        """
+        args:
+        data: Numpy array of uint8. All words encoded as UTF-8, one after another.
+        offsets: Numpy array of ints. Word i is data[offsets[i]:offsets[i+1]].
+        ---------------------------------------------------------------------------
+        Read-only list of words loaded by AutomaticTextGenerator.loadModel.
+        Words are only decoded when they are used, so the arrays can be memory-mapped.
+        """
+        self.data = data
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.data[self.offsets[i]:self.offsets[i + 1]].tostring().decode('UTF-8')
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+class Instrumentation(object):
+    def __init__(self, callback=None):
+        """
+        args:
+        callback: Function called with (phase, seconds) each time a phase ends. (Defaults to None)
+                * For example a logger: lambda phase, seconds: logger.info("%s %.3f", phase, seconds)
+        ---------------------------------------------------------------------------
+        Constructs the timers and counters of an AutomaticTextGenerator object. (self.stats)
+
+        Timers add up the time and number of calls of each phase (method). The time of a phase
+        includes the time of the phases it calls, for example identifyProbabilities includes identifyModel.
+        Counters are added to once for each chunk of text or block of random numbers, and not for each symbol,
+        so the instrumentation is cheap enough to always be on.
+        """
+        self.callback = callback
+        self.reset()
+
+    def reset(self):
+        """
+        Sets all timers and counters to 0.
+        """
+        self.seconds = {}
+        self.calls = {}
+        self.counters = {}
+
+    def addTime(self, phase, seconds):
+        """
+        args:
+        phase: Name of the phase.
+        seconds: Time spent in the phase.
+        ---------------------------------------------------------------------------
+        Adds the time of one call of a phase, and calls self.callback.
+        """
+        self.seconds[phase] = self.seconds.get(phase, 0.0) + seconds
+        self.calls[phase] = self.calls.get(phase, 0) + 1
+        if self.callback is not None:
+            self.callback(phase, seconds)
+
+    def count(self, name, n=1):
+        """
+        args:
+        name: Name of the counter.
+        n: Number to add to the counter. (Defaults to 1)
+        """
+        self.counters[name] = self.counters.get(name, 0) + int(n)
+
+    def report(self):
+        """
+        return:
+        Dictionary of the timers and counters. (Can be saved as JSON)
+        """
+        return {'timers': dict((phase, {'seconds': self.seconds[phase], 'calls': self.calls[phase]})
+                               for phase in self.seconds),
+                'counters': dict(self.counters)}
+
+
+def timed(phase):
+    """
+    args:
+    phase: Name of the phase.
+    return:
+    Decorator adding the time of each call of a method of AutomaticTextGenerator to self.stats.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def timedMethod(self, *args, **kwargs):
+            start = timeit.default_timer()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                self.stats.addTime(phase, timeit.default_timer() - start)
+        return timedMethod
+    return decorator
+
+
+def createFigure(show):
+    """
+    args:
+    show: 1 if the figure will be shown, else 0.
+    return:
+    A pyplot figure if it will be shown, else a figure drawn by the Agg backend. (No display needed)
+    """
+    if show == 1:
+        return plt.figure()
+    figure = Figure()
+    FigureCanvasAgg(figure)
+    return figure
+
+
+def rankCounts(counts, topK):
+    """
+    args:
+    counts: Numpy array of counts. (One count for each symbol, word or pair)
+    topK: Number of the highest counts to find indices of.
+    return:
+    Tuple (top, sortedCounts). Indices of the topK highest counts (highest first), and all counts sorted descending.
+    ---------------------------------------------------------------------------
+    Only the topK highest counts are ranked with their indices (np.argpartition), so only they need labels.
+    Counts that are equal are ranked by index.
+    """
+    counts = np.asarray(counts)
+    sortedCounts = np.sort(counts)[::-1]
+    topK = min(topK, len(counts))
+    if topK == 0:
+        return np.zeros(0, dtype=np.int64), sortedCounts
+    top = np.argpartition(-counts, topK - 1)[:topK]
+    top = top[np.lexsort((top, -counts[top]))]
+    return top, sortedCounts
+
+
+def symbolLabel(symbols):
+    """
+    args:
+    symbols: Unicode string of one or more symbols.
+    return:
+    Label of the symbols for a plot. Spaces are shown as u"\u2423", and other whitespace escaped. (u"\\n")
+    """
+    return u"".join(u"\u2423" if i == u" " else i.encode('unicode_escape').decode('ascii') if i.isspace() else i
+                    for i in symbols)
+
+
+def barPlot(figure, labels, values, title, xlabel):
+    """
+    args:
+    figure: Figure to plot in. (See createFigure)
+    labels: List of labels of the bars.
+    values: Numpy array of the heights of the bars.
+    title: Title of the plot.
+    xlabel: Label of the x-axis.
+    """
+    ax = figure.gca()
+    ax.set_title(title)
+    xAxes = np.arange(len(values))
+    ax.bar(xAxes + 0.6, values)
+    ax.set_xticks(xAxes + 1)
+    # Long labels are turned, so they do not overlap.
+    ax.set_xticklabels(labels, rotation=90 if sum(len(label) for label in labels) > 50 else 0)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel('Number of occurrences (Normalized)')
+    ax.set_xlim(0.0, len(values) + 1)
+
+
+def heatmapPlot(figure, blocks, numStates, labels, title, axisLabel):
+    """
+    args:
+    figure: Figure to plot in. (See createFigure)
+    blocks: Numpy array of block probabilities. (See TransitionTable.toBlocks)
+    numStates: Number of states in the blocks.
+    labels: List of labels of the states, or None to show the ranks of the states on the axes.
+    title: Title of the plot.
+    axisLabel: Label of the axes.
+    """
+    ax = figure.gca()
+    # The axes go from 0 to numStates, so a block covers the ranks of its states.
+    image = ax.imshow(blocks, interpolation='nearest', extent=(0, numStates, numStates, 0))
+    ax.set_title(title)
+    if labels is not None:
+        xAx = np.arange(len(labels)) + 0.5
+        ax.set_xticks(xAx)
+        ax.set_xticklabels(labels)
+        ax.set_yticks(xAx)
+        ax.set_yticklabels(labels)
+    ax.set_xlabel(axisLabel)
+    ax.set_ylabel(axisLabel)
+    figure.colorbar(image)
+
+
+def zipfPlot(figure, curves, title, numPoints=1000):
+    """
+    args:
+    figure: Figure to plot in. (See createFigure)
+    curves: List of tuples (sortedCounts, label). sortedCounts is a numpy array of counts sorted descending.
+    title: Title of the plot.
+    numPoints: Maximum number of points plotted on each curve. (Defaults to 1000)
+    ---------------------------------------------------------------------------
+    Plots rank against normalized frequency on log-log axes. Each curve is plotted at numPoints ranks
+    spaced evenly on the log axis, so the time to draw does not depend on the number of counts.
+    """
+    ax = figure.gca()
+    ax.set_title(title)
+    for sortedCounts, label in curves:
+        if len(sortedCounts) == 0:
+            continue
+        ranks = np.unique(np.logspace(0, np.log10(len(sortedCounts)), numPoints).astype(np.int64))
+        ax.loglog(ranks, sortedCounts[ranks - 1] / sortedCounts.sum(), label=label)
+    ax.set_xlabel('Rank')
+    ax.set_ylabel('Number of occurrences (Normalized)')
+    ax.legend()
+
+
 class AutomaticTextGenerator(object):
-    def __init__(self, model = 1):
+    def __init__(self, model = 1, seed=None, order=1, validate=False, callback=None, cacheSize=None, pairSketch=None):
         """
         args:
         model: Int 1, 2 or 3. Specifies which model to use.
+        seed: Int, None or numpy.random.RandomState. Seed of the random numbers used to generate text.
+                * The same seed generates the same texts. None uses a random seed.
+        order: Number of previous symbols (model 2) or words (model 3) each new symbol depends on. (Defaults to 1)
+                * Higher orders generate text closer to the fed text.
+        validate: True to run the tests of each method, and print the results. (Defaults to False)
+                * The tests check every count and probability, so they are slow for large texts.
+        callback: Function called with (phase, seconds) after each timed method. (Defaults to None)
+                * The timers and counters are stored in self.stats. See Instrumentation.
+        cacheSize: None, or maximum number of rows kept of the tables of model 3 and of the contexts. (Defaults to None)
+                * None creates all rows in self.identifyProbabilities.
+                * An int creates a row the first time a successor of its state is drawn. (See LazyTransitionTable)
+                  self.identifyProbabilities is faster, and the memory of the rows is bounded by cacheSize.
+        pairSketch: None, or a PairSketch to count word-pairs approximately with fixed memory. (Defaults to None)
+                * Only the most frequent word-pairs (the heavy hitters) are kept, with estimated counts.
+                  See PairSketch.errorBounds for the error of the counts.
         ---------------------------------------------------------------------------
         Constructs Automatic Text Generator object.
 
@@ -50,32 +1629,135 @@ class AutomaticTextGenerator(object):
             Generates text of previously dependent pairs of symbols.
         Model 3:
             Generates text of previously dependent words.
+        With order > 1, models 2 and 3 depend on the previous order symbols or words. (See ContextStore)
         """
         self.textFile = None
+        self.validate = validate
+        self.cacheSize = cacheSize
+        self.pairSketch = pairSketch
+        # Pruning of the tables of model 3. (See self.identifyProbabilities)
+        self.pruning = {'minWordCount': 1, 'minPairCount': 1, 'topK': None}
+        self.pruningStats = {}
+        # Timers and counters of this object.
+        self.stats = Instrumentation(callback)
+        # Random number generator of this object.
+        if isinstance(seed, np.random.RandomState):
+            self.rng = seed
+        else:
+            self.rng = np.random.RandomState(seed)
         self.alphabet = {}
         self.cleanAlphabet = {}
+        self.symbolList = []
+        self.symbolIndex = {}
         self.pairs = {}
-        self.words = {}
-        self.wordPairs = {}
+        self.pairCounts = None
+        self.vocabulary = []
+        self.wordIndex = {}
+        self.wordCounts = np.zeros(0, dtype=np.int64)
+        self.wordPairKeys = np.zeros(0, dtype=np.int64)
+        self.wordPairCounts = np.zeros(0, dtype=np.int64)
+        self.newWordPairKeys = []
+        self.wordViews = {}
         self.text = ""
         self.cleanText = ""
         self.newtext = ""
         self.normSymbols = {}
         self.normPairs = {}
-        self.normWords = {}
-        self.normWordPairs = {}
         self.validTransformations = {}
         self.pairTableArray = None
-        self.wordPairTableArray = None
-        self.validWordTransformations = {}
+        self.symbolSampler = None
+        self.pairTransitions = None
+        self.wordTransitions = None
+        self.symbolContexts = None
+        self.wordContexts = None
         self.symbolCount = 0
+        self.wordCount = 0
+        self.wordPattern = None
+        self.symbolCodes = None
+        self.letterMask = None
+        self.lastSymbol = None
+        self.lastWord = None
+        self.partialWord = u""
         self.defined = False
         self.fed = False
         self.identified = False
+        # Models whose counts have been made from the fed text. (1 for the symbols)
+        self.countedModels = set()
         if 4 > model > 0:
             self.model = model
         else:
             raise ValueError("model must be int 1, 2 or 3")
+        if order >= 1:
+            self.order = int(order)
+        else:
+            raise ValueError("order must be int 1 or more")
+
+    ################################################################################
+    # Model 3 stores words as indices in self.vocabulary, and counts in numpy arrays.
+    # The following dictionaries with words as keys are only created when they are used.
+    ################################################################################
+    @property
+    def words(self):
+        """
+        Dictionary of words and their number of occurrences. (Created from self.wordCounts)
+        """
+        if 'words' not in self.wordViews:
+            self.wordViews['words'] = dict(zip(self.vocabulary, self.wordCounts.tolist()))
+        return self.wordViews['words']
+
+    @property
+    def wordPairs(self):
+        """
+        Dictionary of word-pairs (tuples) and their number of occurrences. (Created from self.wordPairCounts)
+        """
+        if 'wordPairs' not in self.wordViews:
+            self.consolidateWordPairs()
+            firstWords, secondWords = self.splitWordPairKeys(self.wordPairKeys)
+            self.wordViews['wordPairs'] = dict(
+                ((self.vocabulary[i], self.vocabulary[j]), count) for i, j, count in
+                zip(firstWords.tolist(), secondWords.tolist(), self.wordPairCounts.tolist()))
+        return self.wordViews['wordPairs']
+
+    @property
+    def normWords(self):
+        """
+        Dictionary of words and their normalized number of occurrences.
+        """
+        if 'normWords' not in self.wordViews:
+            self.wordViews['normWords'] = dict(
+                (word, count / len(self.vocabulary)) for word, count in self.words.iteritems())
+        return self.wordViews['normWords']
+
+    @property
+    def normWordPairs(self):
+        """
+        Dictionary of word-pairs (tuples) and their normalized number of occurrences.
+        Empty until self.identifyProbabilities has been called for model 3.
+        """
+        if self.wordTransitions is None:
+            return {}
+        if 'normWordPairs' not in self.wordViews:
+            normFact = self.wordPairCounts.sum()
+            self.wordViews['normWordPairs'] = dict(
+                (key, count / normFact) for key, count in self.wordPairs.iteritems())
+        return self.wordViews['normWordPairs']
+
+    @property
+    def validWordTransformations(self):
+        """
+        Dictionary of words, and for each word a dictionary of the following words and their probabilities.
+        Empty until self.identifyProbabilities has been called for model 3.
+        """
+        if self.wordTransitions is None:
+            return {}
+        if 'validWordTransformations' not in self.wordViews:
+            validWordTransformations = {}
+            for i, word in enumerate(self.vocabulary):
+                nextWords, probs = self.wordTransitions.row(i)
+                validWordTransformations[word] = dict(
+                    (self.vocabulary[j], p) for j, p in zip(nextWords.tolist(), probs.tolist()))
+            self.wordViews['validWordTransformations'] = validWordTransformations
+        return self.wordViews['validWordTransformations']
 
     def changeModel(self, model):
         """
@@ -83,8 +1765,11 @@ class AutomaticTextGenerator(object):
         model: Int 1, 2 or 3. Specifies which model to change to.
         ---------------------------------------------------------------------------
         Changes model used for generating text. See model description in self.__init__ docstring.
-        If object has not yet been initialized for the new model the methods,
-        self.feedInput(file) (with same textfile) and self.identifyProbabilities() are called again.
+        If the text has not yet been counted for the new model, self.feedInput(file) (with same textfile)
+        is called again. If the files were fed with self.trainParallel(files), it is called again instead.
+        If the object has not yet been identified for the new model, self.identifyProbabilities() is called again.
+        If the object was initialized with allModels=True, only the model number is changed.
+        Counts are never made twice. (See self.countedModels)
         """
 
         if 0 < model < 4:
@@ -92,16 +1777,18 @@ class AutomaticTextGenerator(object):
         else:
             raise ValueError("model must be int 1, 2 or 3")
 
-        if self.model == 1 and len(self.normSymbols) == 0:
-            self.feedInput(self.textFile, True)
-            self.identifyProbabilities(True)
-        elif self.model == 2 and len(self.normPairs) == 0:
-            self.feedInput(self.textFile, True)
-            self.identifyProbabilities(True)
-        elif self.model == 3 and len(self.normWordPairs) == 0:
-            self.feedInput(self.textFile, True)
+        if self.model not in self.countedModels:
+            # Files fed with self.trainParallel are stored as a list.
+            if isinstance(self.textFile, list):
+                self.trainParallel(self.textFile, sameFile=True)
+            else:
+                self.feedInput(self.textFile, True)
+        if self.model == 1 and len(self.normSymbols) == 0 or \
+                self.model == 2 and len(self.normPairs) == 0 or \
+                self.model == 3 and self.wordTransitions is None:
             self.identifyProbabilities(True)
 
+    @timed('defineAlphabet')
     def defineAlphabet(self, alphabet, language="Danish"):
         """
         args:
@@ -119,10 +1806,15 @@ class AutomaticTextGenerator(object):
 
         Creates keys in self.alphabet for every element in text file.
         Creates keys in self.cleanAlphabet for every letter-symbol in text file.
+        Creates list self.symbolList of the symbols in the order of the text file,
+        and self.symbolIndex, the index of each symbol in that list.
+        Creates regular expression self.wordPattern, used to find words in the text.
+        Creates numpy arrays self.symbolCodes and self.letterMask, used to convert text to symbol indices.
         """
         if self.defined:
             self.alphabet = {}
             self.cleanAlphabet = {}
+            self.symbolList = []
         self.defined = True
         # Checks which language is used, and stores number of letter-symbols in numLetters.
         if language == "Danish":
@@ -136,18 +1828,21 @@ class AutomaticTextGenerator(object):
             n = 0
             for line in alph:
                 for i in line:
+                    # Skip unwanted symbol. (BOM, if the file starts with one)
+                    if i == u'\ufeff':
+                        continue
+                    if i not in self.alphabet:
+                        self.symbolList.append(i)
                     # Create keys in self.alphabet for each symbol.
                     self.alphabet[i] = 0
                     # Also create keys in self.cleanAlphabet for each letter-symbol.
                     # If language argument is left out, danish is assumed (so there are 29 letters)
-                    if n < numLetters + 1:
+                    if n < numLetters:
                         self.cleanAlphabet[i] = 0
                     n += 1
-        # Delete unwanted symbol. (BOM)
-        del self.alphabet[u'\ufeff']
-        del self.cleanAlphabet[u'\ufeff']
+        self.createSymbolTables()
         # Tests
-        if __debug__:
+        if self.validate:
             print "~"*80
             print "Tests for defineAlphabet method:"
             print "Length of alphabet is".format(len(self.alphabet)), len(self.alphabet)
@@ -164,15 +1859,87 @@ class AutomaticTextGenerator(object):
             elif not flag:
                 print "The keys of self.cleanAlphabet are all in self.alphabet, False"
 
-    def feedInput(self, textfile, sameFile=False):
+    def createSymbolTables(self):
+        """
+        Creates self.symbolIndex, self.symbolCodes, self.letterMask and self.wordPattern
+        from self.symbolList and self.cleanAlphabet. Used by self.defineAlphabet and self.loadModel.
+        """
+        self.symbolIndex = dict((symbol, i) for i, symbol in enumerate(self.symbolList))
+        # Create lookup tables from code point (ord(symbol)) to index in self.symbolList, and to letter or not.
+        # Code points outside the alphabet map to index -1. The last element is used for all larger code points.
+        tableSize = max(ord(i) for i in self.symbolList) + 2
+        self.symbolCodes = np.full(tableSize, -1, dtype=np.int32)
+        for n, i in enumerate(self.symbolList):
+            self.symbolCodes[ord(i)] = n
+        self.letterMask = np.zeros(tableSize, dtype=bool)
+        for i in self.cleanAlphabet:
+            self.letterMask[ord(i)] = True
+        # Create regular expression matching words. (Sequences of letter-symbols)
+        self.wordPattern = re.compile(u"[" + u"".join(re.escape(i) for i in self.cleanAlphabet) + u"]+", re.UNICODE)
+
+    def resetCounts(self):
+        """
+        Resets the text and all counts, before feeding a new file.
+        """
+        self.text = ""
+        self.cleanText = ""
+        for key in self.alphabet:
+            self.alphabet[key] = 0
+        self.symbolCount = 0
+        self.pairs = {}
+        self.pairCounts = None
+        self.vocabulary = []
+        self.wordIndex = {}
+        self.wordCounts = np.zeros(0, dtype=np.int64)
+        self.wordPairKeys = np.zeros(0, dtype=np.int64)
+        self.wordPairCounts = np.zeros(0, dtype=np.int64)
+        self.newWordPairKeys = []
+        if self.pairSketch is not None:
+            self.pairSketch.reset()
+        self.validTransformations = {}
+        self.symbolContexts = None
+        self.wordContexts = None
+        self.countedModels = set()
+
+    def createContextStores(self, models):
+        """
+        args:
+        models: Tuple of models to count for.
+        ---------------------------------------------------------------------------
+        Creates self.symbolContexts (model 2) and self.wordContexts (model 3) if the object has order > 1,
+        and resets the tokens carried over from the last text.
+        """
+        if self.order == 1:
+            return
+        if 2 in models and self.symbolContexts is None:
+            self.symbolContexts = ContextStore(self.order, self.cacheSize)
+        if 3 in models and self.wordContexts is None:
+            self.wordContexts = ContextStore(self.order, self.cacheSize)
+        for store in (self.symbolContexts, self.wordContexts):
+            if store is not None:
+                store.lastTokens = np.zeros(0, dtype=np.int64)
+
+    @timed('feedInput')
+    def feedInput(self, textfile, sameFile=False, chunkSize=2**20, keepText=True, allModels=False):
         """
         args:
         textfile: Text file ('name.txt') containing the text you want to use for generating new text.
                     File must be UTF-8 encoded.
         sameFile: Optional argument if user wants to use same file as last file.
+        chunkSize: Number of bytes read from the file at a time. (Defaults to 2**20)
+        keepText: False to not store the text in self.text and self.cleanText. (Defaults to True)
+                * Saves memory when feeding large files. The counts are the same.
+        allModels: True to count for all three models while reading the file once. (Defaults to False)
+                * Call self.identifyProbabilities(allModels=True) afterwards.
+                * self.changeModel then does not have to feed the file again.
         ---------------------------------------------------------------------------
         Feeds text to object. The specified text generation model determines some of the functionality of this method.
 
+        The file is read in chunks of about chunkSize bytes (decoded to fewer characters, if some take more than
+        one byte), and the counts are updated one chunk at a time.
+        The last symbol, last word and unfinished word of a chunk are carried over to the next chunk,
+        so the counts are the same as if the whole file was read at once.
+
         Important functionality:
             ----SHARED----
             - Adds all text to variable self.text. (Only valid symbols)
@@ -182,94 +1949,37 @@ class AutomaticTextGenerator(object):
             - Finds count of symbols in self.text, saves in self.symbolCount.
 
             ----ONLY MODEL 2----
+            - Counts up all occurrences of pairs in text in numpy array self.pairCounts.
+                * self.pairCounts[i, j] is the count of pair 'self.symbolList[i] + self.symbolList[j]'.
             - Creates keys in self.pairs for every pair of valid symbols in text.
-            - Counts up all occurrences of pairs in text.
                 * The number of occurrences are saved as values to the symbols(keys) in self.pairs.
 
             ----ONLY MODEL 3----
-            - Creates keys in self.words for every word in cleanText.
+            - Gives every new word in cleanText an index. (Appends word to self.vocabulary)
+                * self.wordIndex is the index of each word in self.vocabulary.
             - Counts up all occurrences of words in text.
-                * The number of occurrences are saved as values to the symbols(keys) in self.words.
-            - Creates keys in self.wordPairs for every pair of words in cleanText.
+                * The number of occurrences are saved in numpy array self.wordCounts. (Index of word)
+                * self.words contains the same information, but in a dictionary.
             - Counts up all occurrences of word pairs in text.
-                * The number of occurrences are saved as values to the symbols(keys) in self.wordPairs.
+                * Pairs are stored as ints in sorted numpy array self.wordPairKeys. See self.splitWordPairKeys.
+                * The number of occurrences are saved in numpy array self.wordPairCounts.
+                * self.wordPairs contains the same information, but in a dictionary.
+
+            ----ONLY ORDER > 1----
+            - Counts up the transitions between contexts of self.order symbols (model 2) in self.symbolContexts,
+              and of self.order words (model 3) in self.wordContexts. See ContextStore.
         """
         if not self.defined:
             raise ValueError("You have not defined an alphabet for this object.")
-        # If object has already been fed, reset values.
-        if self.fed and not sameFile:
-            self.text = ""
-            self.cleanText = ""
-            for key in self.alphabet:
-                self.alphabet[key] = 0
-            self.pairs = {}
-            self.words = {}
-            self.wordPairs = {}
-            self.validTransformations = {}
-            self.validWordTransformations = {}
-        self.fed = True
-        self.textFile = textfile
-        if not sameFile:
-            with codecs.open(textfile, 'r', encoding="UTF-8") as textfile:
-                for line in textfile:
-                    for i in line:
-                        if i in self.alphabet:
-                            # Add elements to self.text if elements are valid symbols.
-                            self.text += i
-                            # Count up occurrences of symbols.
-                            self.alphabet[i] += 1
-                        if i in self.cleanAlphabet:
-                            # Add elements to self.cleanText if elements are valid symbols except comma and period.
-                            self.cleanText += i
-                        elif i not in self.cleanAlphabet:
-                            # If element is comma or period add space to self.cleanText.
-                            self.cleanText += " "
-            # Find count of symbols
-            self.symbolCount = len(self.text)
-        for i in self.alphabet:
-            if i not in self.validTransformations:
-                # Create a key in self.validTransformation for each symbol.
-                self.validTransformations[i] = []
-        # Create keys for self.pairs if model is 2
-        if self.model == 2:
-            # Create empty string, splitText, and append all elements from self.text separated by '-'
-            splitText = ""
-            for i in self.text:
-                splitText += i + "-"
-            # Create list, symbolList, of all elements between '-' in splitText
-            symbolList = splitText.split('-')
-            # For every symbol create or count up key in self.pairs. Key is 'symbol + next symbol'
-            for j, i in enumerate(symbolList):
-                if j < len(symbolList)-1:
-                    a, b = symbolList[j], symbolList[j+1]
-                    newPair = (a + b)
-                    if newPair not in self.pairs:
-                        self.pairs[newPair] = 0
-                    else:
-                        self.pairs[newPair] += 1
-        # Create keys for self.words and self.wordPairs if model is 3.
-        if self.model == 3:
-            # Create list, wordList, of all words in self.cleanText.
-            # Create or count up key in self.words for each word in wordList
-            wordList = self.cleanText.split()
-            for word in wordList:
-                if word not in self.words:
-                    self.words[word] = 1
-                    # Create a key in self.validWordTransformation for each word.
-                    self.validWordTransformations[word] = []
-                else:
-                    self.words[word] += 1
-            # For every word create or count up key in self.wordPairs. Key is 'word + next word'
-            n = 0
-            for j, i in enumerate(wordList):
-                if j < len(wordList)-1:
-                    newWordPair = (wordList[j], wordList[j+1])
-                    if newWordPair not in self.wordPairs:
-                        self.wordPairs[newWordPair] = 1
-                    else:
-                        self.wordPairs[newWordPair] += 1
+        models = self._startFeed(textfile, sameFile, allModels)
+        # Symbols and text are only counted and stored the first time a file is fed.
+        countSymbols = not sameFile
+        texts = self._readText(textfile, chunkSize, countSymbols, countSymbols and keepText, models)
+        if texts is not None:
+            self.text, self.cleanText = texts
+        self._finishFeed(models, countSymbols)
         # Tests
-        if __debug__:
+        if self.validate:
             print "~"*80
             print "Tests for feedInput method:"
             print "The sum of all values in self.alphabet({0})" \
@@ -278,54 +1988,566 @@ class AutomaticTextGenerator(object):
             print "The length of self.validTransformation({0})" \
                   " is equal to the length of self.alphabet,".format(len(self.validTransformations)), \
                 len(self.validTransformations) == len(self.alphabet)
-            if self.model == 3:
-                print "The sum of all values in self.words({0})" \
-                      " is equal to count of words,".format(sum(self.words.values())),\
-                    sum(self.words.values()) == len(wordList)
-                print "The length of self.validWordTransformation({0})" \
-                      " is equal to the length of self.words,".format(len(self.validWordTransformations)), \
-                    len(self.validWordTransformations) == len(self.words)
+            if 3 in models:
+                print "The sum of all values in self.wordCounts({0})" \
+                      " is equal to count of words,".format(self.wordCounts.sum()),\
+                    self.wordCounts.sum() == self.wordCount
+                print "The length of self.wordCounts({0})" \
+                      " is equal to the length of self.vocabulary,".format(len(self.wordCounts)), \
+                    len(self.wordCounts) == len(self.vocabulary)
+
+    def _startFeed(self, textFile, sameFile, allModels):
+        """
+        args:
+        textFile, sameFile, allModels: See self.feedInput. (textFile is a list of files for self.trainParallel)
+        return:
+        Tuple of the models to count pairs or words for.
+        ---------------------------------------------------------------------------
+        Resets the counts if the object has already been fed another file, and selects the models to count.
+        Models already counted from the same file are not counted twice. Used by self.feedInput and self.trainParallel.
+        """
+        if self.fed and not sameFile:
+            self.resetCounts()
+        self.fed = True
+        self.textFile = textFile
+        models = tuple(model for model in ((1, 2, 3) if allModels else (self.model,))
+                       if model not in self.countedModels)
+        if 3 in models:
+            self.wordCount = 0
+        return models
+
+    def _resetFeedState(self, models):
+        """
+        args:
+        models: Tuple of models to count pairs or words for.
+        ---------------------------------------------------------------------------
+        Resets the last symbol, last word and unfinished word carried over between chunks (and shards),
+        so a new text does not continue from the text fed before, and creates the counts which do not exist yet.
+        Used by self.feedInput, self.trainParallel and self.update.
+        """
+        self.lastSymbol = None
+        self.lastWord = None
+        self.partialWord = u""
+        if 2 in models and self.pairCounts is None:
+            self.pairCounts = np.zeros((len(self.symbolList), len(self.symbolList)), dtype=np.int64)
+        self.createContextStores(models)
+
+    def _readText(self, textfile, chunkSize, countSymbols, keepText, models):
+        """
+        args:
+        textfile: Text file ('name.txt'). File must be UTF-8 encoded.
+        chunkSize: Number of bytes read from the file at a time.
+        countSymbols, keepText, models: See self.feedChunk.
+        return:
+        Tuple (text, clean text) of the file if keepText is True, else None.
+        ---------------------------------------------------------------------------
+        Counts the text of a file one chunk at a time, after resetting the state carried over between chunks.
+        The unfinished word at the end of the file is counted as well. Used by self.feedInput and self.update.
+        """
+        self._resetFeedState(models)
+        textParts, cleanTextParts = [], []
+        with codecs.open(textfile, 'r', encoding="UTF-8") as textfile:
+            while True:
+                chunk = textfile.read(chunkSize)
+                if not chunk:
+                    break
+                chunkTexts = self.feedChunk(chunk, countSymbols, keepText, models)
+                if chunkTexts is not None:
+                    textParts.append(chunkTexts[0])
+                    cleanTextParts.append(chunkTexts[1])
+        # Count the unfinished word at the end of the file.
+        if self.partialWord:
+            self.countWords([self.partialWord])
+            self.partialWord = u""
+        self.consolidateWordPairs()
+        self.wordViews = {}
+        if keepText:
+            return u"".join(textParts), u"".join(cleanTextParts)
+        return None
+
+    def _finishFeed(self, models, countSymbols):
+        """
+        args:
+        models: Tuple of the models which were counted.
+        countSymbols: True if the symbols were counted.
+        ---------------------------------------------------------------------------
+        Creates self.pairs, marks the models as counted, and creates a key in self.validTransformations
+        for each symbol. Used by self.feedInput and self.trainParallel.
+        """
+        if 2 in models:
+            self.createPairs()
+        self.countedModels.update(models)
+        if countSymbols:
+            self.countedModels.add(1)
+        for i in self.alphabet:
+            if i not in self.validTransformations:
+                # Create a key in self.validTransformation for each symbol.
+                self.validTransformations[i] = []
+
+    @timed('feedChunk')
+    def feedChunk(self, chunk, countSymbols=True, keepText=False, models=None):
+        """
+        args:
+        chunk: Unicode string. Part of the text being fed.
+        countSymbols: False to only count pairs or words. (Used when feeding same file again)
+        keepText: True to return the valid symbols and the clean text of chunk.
+        models: Tuple of models to count pairs or words for. (Defaults to (self.model,))
+        return:
+        Tuple of unicode strings (text, cleanText) if keepText is True, else None.
+        ---------------------------------------------------------------------------
+        Updates the counts with the text in chunk. Called by self.feedInput for each chunk of the file.
+
+        The chunk is converted to a numpy array of symbol indices (self.symbolList order),
+        so symbols and symbol-pairs are counted with numpy.bincount instead of a loop over the text.
+        Uses self.lastSymbol (index), self.lastWord (index) and self.partialWord to count the pairs and words
+        which continue from the previous chunk.
+        """
+        if models is None:
+            models = (self.model,)
+        # Convert chunk to array of code points, and look up the index in self.symbolList of each code point.
+        codePoints = np.frombuffer(chunk.encode('utf-32-le'), dtype=np.uint32)
+        codePoints = np.minimum(codePoints, len(self.symbolCodes) - 1)
+        codes = self.symbolCodes[codePoints]
+        # Create array, symbolCodes, of the indices of all valid symbols in chunk.
+        numSymbols = len(self.symbolList)
+        symbolCodes = codes[codes >= 0].astype(np.uint8 if numSymbols <= 256 else np.uint16)
+        if countSymbols:
+            # Count up occurrences of symbols.
+            symbolCounts = np.bincount(symbolCodes, minlength=numSymbols)
+            for n in np.flatnonzero(symbolCounts):
+                self.alphabet[self.symbolList[n]] += int(symbolCounts[n])
+            self.symbolCount += len(symbolCodes)
+        self.stats.count('chunks')
+        self.stats.count('charactersRead', len(chunk))
+        self.stats.count('symbolsRead', len(symbolCodes))
+        # Count up pairs in self.pairCounts if model is 2
+        if 2 in models and len(symbolCodes) > 0:
+            pairCodes = symbolCodes.astype(np.int64)
+            # Continue from the last symbol of the previous chunk.
+            if self.lastSymbol is not None:
+                pairCodes = np.concatenate(([self.lastSymbol], pairCodes))
+            # Pair (i, j) is counted at position i * numSymbols + j.
+            pairCounts = np.bincount(pairCodes[:-1] * numSymbols + pairCodes[1:], minlength=numSymbols ** 2)
+            self.pairCounts += pairCounts.reshape(numSymbols, numSymbols)
+            self.stats.count('symbolPairsSeen', len(pairCodes) - 1)
+            self.lastSymbol = int(pairCodes[-1])
+            if self.symbolContexts is not None:
+                self.symbolContexts.countTokens(symbolCodes)
+        # Count up words and word-pairs if model is 3.
+        if 3 in models:
+            # Create list, wordList, of all words in chunk. Words are separated by any symbol that is not a letter.
+            text = self.partialWord + chunk
+            wordList = self.wordPattern.findall(text)
+            # If chunk ends with a letter, the last word might continue in the next chunk.
+            if wordList and text[-1] in self.cleanAlphabet:
+                self.partialWord = wordList.pop()
+            else:
+                self.partialWord = u""
+            self.countWords(wordList)
+        if keepText:
+            # Text contains the valid symbols. Clean text has a space instead of every symbol that is not a letter.
+            text = codePoints[codes >= 0].astype('<u4').tostring().decode('utf-32-le')
+            cleanText = np.where(self.letterMask[codePoints], codePoints, ord(u" ")).astype('<u4')
+            return text, cleanText.tostring().decode('utf-32-le')
 
-    def identifyProbabilities(self, sameFile=False):
+    @timed('trainParallel')
+    def trainParallel(self, files, workers=None, sameFile=False, allModels=False, shardSize=2**22, chunkSize=2**20):
+        """
+        args:
+        files: List of text files ('name.txt'). Files must be UTF-8 encoded.
+        workers: Amount of worker processes. (Defaults to None, which uses one per core)
+        sameFile: Optional argument if user wants to use same files as last files.
+        allModels: True to count and identify for all three models. (Defaults to False)
+        shardSize: Size in bytes of the shards counted by each worker. (Defaults to 2**22)
+        chunkSize: Size in bytes of the chunks a worker reads at a time. (Defaults to 2**20)
+        ---------------------------------------------------------------------------
+        Feeds many files to the object with a pool of processes, and calls self.identifyProbabilities once.
+
+        Each file is split into shards of shardSize bytes, which are counted by the workers (see trainShard),
+        and the counts of the shards are added up in order.
+        Pairs of symbols and words which cross the border between two shards, or two files, are counted as well.
+        Words are not continued from one file to the next.
+        The counts are the same as when feeding the files one after another without resetting the counts,
+        but self.text and self.cleanText are not stored.
+        """
+        if not self.defined:
+            raise ValueError("You have not defined an alphabet for this object.")
+        if self.order > 1:
+            raise ValueError("trainParallel only supports order 1. Use feedInput for each file instead.")
+        models = self._startFeed(list(files), sameFile, allModels)
+        countSymbols = not sameFile
+        self._resetFeedState(models)
+        # Split the files into shards, starting at the first byte of a character.
+        letters = list(self.cleanAlphabet)
+        tasks = []
+        for filename in self.textFile:
+            size = os.path.getsize(filename)
+            offsets = sorted(set([alignOffset(filename, offset) for offset in range(0, size, shardSize)] + [size]))
+            for start, stop in zip(offsets[:-1], offsets[1:]):
+                tasks.append((self.symbolList, letters, filename, start, stop, models, countSymbols, chunkSize))
+        if workers == 1:
+            pool = None
+            results = itertools.imap(trainShard, tasks)
+        else:
+            pool = multiprocessing.Pool(workers)
+            results = pool.imap(trainShard, tasks)
+        countedKeys, counts = [], []
+        try:
+            for task, result in zip(tasks, results):
+                self.mergeShard(result, models, countSymbols, countedKeys, counts)
+                if self.pairSketch is not None:
+                    # Add each shard to the sketch, so the memory of the pairs stays fixed.
+                    self.consolidateWordPairs(countedKeys, counts)
+                    del countedKeys[:], counts[:]
+                # Words are not continued from one file to the next. Count the unfinished word at the end of a file.
+                if task[4] == os.path.getsize(task[2]) and self.partialWord:
+                    self.countWords([self.partialWord])
+                    self.partialWord = u""
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        self.consolidateWordPairs(countedKeys, counts)
+        self.wordViews = {}
+        self._finishFeed(models, countSymbols)
+        self.identifyProbabilities(sameFile, allModels)
+
+    def mergeShard(self, result, models, countSymbols, countedKeys, counts):
+        """
+        args:
+        result: Dictionary of counts returned by trainShard.
+        models: Tuple of models the shard was counted for.
+        countSymbols: False to not add the symbol counts.
+        countedKeys: List. The word-pairs of the shard are appended, with indices in self.vocabulary.
+        counts: List. The count of each word-pair in countedKeys is appended.
+        ---------------------------------------------------------------------------
+        Adds the counts of one shard to the counts of the object. Used by self.trainParallel.
+        The shards must be merged in the order of the text.
+        self.lastSymbol, self.lastWord and self.partialWord continue from the previous shard, like in self.feedChunk.
+        """
+        if countSymbols:
+            for n in np.flatnonzero(result['symbolCounts']):
+                self.alphabet[self.symbolList[n]] += int(result['symbolCounts'][n])
+            self.symbolCount += result['symbolCount']
+        if 2 in models:
+            self.pairCounts += result['pairCounts']
+            # Count the pair of the last symbol of the previous shard, and the first symbol of this shard.
+            if result['firstSymbol'] is not None:
+                if self.lastSymbol is not None:
+                    self.pairCounts[self.lastSymbol, result['firstSymbol']] += 1
+                self.lastSymbol = result['lastSymbol']
+        if 3 in models:
+            # The head continues the unfinished word of the previous shard.
+            self.partialWord += result['head']
+            if result['allLetters']:
+                return
+            if self.partialWord:
+                self.countWords([self.partialWord])
+                self.partialWord = u""
+            if result['wordCount'] > 0:
+                # Convert the indices of the shard vocabulary to indices in self.vocabulary.
+                wordIds = np.array(self.getWordIds(result['vocabulary']), dtype=np.int64)
+                wordCounts = np.zeros(len(self.vocabulary), dtype=np.int64)
+                wordCounts[:len(self.wordCounts)] = self.wordCounts
+                wordCounts[wordIds] += result['wordCounts']
+                self.wordCounts = wordCounts
+                firstWords, secondWords = self.splitWordPairKeys(result['wordPairKeys'])
+                countedKeys.append(self.wordPairKey(wordIds[firstWords], wordIds[secondWords]))
+                counts.append(result['wordPairCounts'])
+                # Count the pair of the last word before the shard, and the first word of the shard.
+                # The first word of the shard has index 0 in the shard vocabulary.
+                if self.lastWord is not None:
+                    self.newWordPairKeys.append(self.wordPairKey(np.array([self.lastWord]), wordIds[:1]))
+                self.lastWord = int(wordIds[result['lastWord']])
+                self.wordCount += result['wordCount']
+            self.partialWord = result['tail']
+
+    def countWords(self, wordList):
+        """
+        args:
+        wordList: List of words, in the order they occur in the text.
+        ---------------------------------------------------------------------------
+        Counts up words in self.wordCounts, and pairs of words in self.wordPairCounts.
+        New words are appended to self.vocabulary.
+        The first word of wordList is paired with self.lastWord. (Index of last word)
+        """
+        wordIds = self.getWordIds(wordList)
+        if not wordIds:
+            return
+        # Count up occurrences of words.
+        wordCounts = np.bincount(wordIds, minlength=len(self.vocabulary))
+        wordCounts[:len(self.wordCounts)] += self.wordCounts
+        self.wordCounts = wordCounts
+        if self.wordContexts is not None:
+            self.wordContexts.countTokens(wordIds)
+        # Store the pairs of words, starting with the last word of the previous chunk. Counted later.
+        if self.lastWord is not None:
+            wordIds.insert(0, self.lastWord)
+        wordIds = np.array(wordIds, dtype=np.int64)
+        self.newWordPairKeys.append(self.wordPairKey(wordIds[:-1], wordIds[1:]))
+        self.stats.count('wordPairsSeen', len(wordIds) - 1)
+        # Count up the stored pairs, when there are more stored pairs than counted pairs.
+        if sum(len(keys) for keys in self.newWordPairKeys) > max(len(self.wordPairKeys), 2**20):
+            self.consolidateWordPairs()
+        self.lastWord = int(wordIds[-1])
+        self.wordCount += len(wordList)
+        self.stats.count('wordsRead', len(wordList))
+
+    def getWordIds(self, wordList):
+        """
+        args:
+        wordList: List of words.
+        return:
+        List of the index in self.vocabulary of each word. New words are appended to self.vocabulary.
+        """
+        if self.wordIndex is None:
+            # Vocabulary was loaded by self.loadModel. Create list and dictionary of words, to add new words.
+            self.vocabulary = list(self.vocabulary)
+            self.wordIndex = dict((word, i) for i, word in enumerate(self.vocabulary))
+        # Find the index of each word in wordList. Give new words the next index.
+        wordIds = []
+        for word in wordList:
+            i = self.wordIndex.get(word)
+            if i is None:
+                i = len(self.vocabulary)
+                self.wordIndex[word] = i
+                self.vocabulary.append(word)
+            wordIds.append(i)
+        return wordIds
+
+    def wordPairKey(self, firstWords, secondWords):
+        """
+        args:
+        firstWords: Numpy array of indices of first words.
+        secondWords: Numpy array of indices of second words.
+        return:
+        Numpy array of int64. Each pair of words stored as one int. (firstWord * 2**32 + secondWord)
+        """
+        return (firstWords.astype(np.int64) << 32) | secondWords.astype(np.int64)
+
+    def splitWordPairKeys(self, keys):
+        """
+        args:
+        keys: Numpy array of int64 created by self.wordPairKey.
+        return:
+        Tuple of numpy arrays. (indices of first words, indices of second words)
+        """
+        return keys >> 32, keys & 0xFFFFFFFF
+
+    def consolidateWordPairs(self, countedKeys=(), counts=()):
+        """
+        args:
+        countedKeys: List of numpy arrays of pairs (keys) which have already been counted. (Defaults to none)
+        counts: List of numpy arrays of the count of each key in countedKeys.
+        ---------------------------------------------------------------------------
+        Counts up the pairs stored in self.newWordPairKeys, and adds them to self.wordPairKeys and
+        self.wordPairCounts. self.wordPairKeys stays sorted, with one element for each distinct pair.
+        The counts of countedKeys are added as well. (Used by self.trainParallel)
+        With self.pairSketch, the pairs are added to the sketch instead, and self.wordPairKeys and
+        self.wordPairCounts are its heavy hitters and their estimated counts.
+        """
+        if not self.newWordPairKeys and not countedKeys:
+            return
+        if self.pairSketch is not None:
+            self.pairSketch.add(np.concatenate(self.newWordPairKeys + list(countedKeys)),
+                                np.concatenate([np.ones(len(newKeys), dtype=np.int64)
+                                                for newKeys in self.newWordPairKeys] +
+                                               [np.asarray(c, dtype=np.int64) for c in counts]))
+            self.wordPairKeys, self.wordPairCounts = self.pairSketch.getPairs()
+            self.newWordPairKeys = []
+            return
+        keys = np.concatenate([self.wordPairKeys] + self.newWordPairKeys + list(countedKeys))
+        counts = np.concatenate([self.wordPairCounts] +
+                                [np.ones(len(newKeys), dtype=np.int64) for newKeys in self.newWordPairKeys] +
+                                [np.asarray(c, dtype=np.int64) for c in counts])
+        self.wordPairKeys, inverse = np.unique(keys, return_inverse=True)
+        self.wordPairCounts = np.bincount(inverse, weights=counts).astype(np.int64)
+        self.newWordPairKeys = []
+
+    def createPairs(self):
+        """
+        Creates keys in self.pairs for every pair with a count in self.pairCounts. Key is 'symbol + next symbol'
+        """
+        firstSymbols, secondSymbols = np.nonzero(self.pairCounts)
+        self.pairs = dict((self.symbolList[i] + self.symbolList[j], int(self.pairCounts[i, j]))
+                          for i, j in zip(firstSymbols.tolist(), secondSymbols.tolist()))
+
+    def normalizePairs(self):
+        """
+        Creates self.normPairs, self.pairTableArray and self.validTransformations from the pair counts.
+        """
+        # Calculate normalization factor.
+        normFact = sum(self.pairs.values())
+        for key in self.pairs:
+            # Create keys in self.normPairs for each key(symbol-pair) in self.pairs.
+            self.normPairs[key] = self.pairs[key] / normFact
+        # Create array, self.pairTableArray, by normalizing each row of self.pairCounts.
+        # Rows and columns are in the same order as self.symbolList. Rows of symbols without successors are 0.0.
+        rowTotals = self.pairCounts.sum(axis=1)
+        self.pairTableArray = self.pairCounts / np.maximum(rowTotals, 1)[:, np.newaxis]
+        # Store the same information in the dict self.validTransformations.
+        for n, i in enumerate(self.symbolList):
+            self.validTransformations[i] = self.pairTableArray[n].tolist()
+
+    @timed('update')
+    def update(self, textfile, chunkSize=2**20, keepText=False):
+        """
+        args:
+        textfile: Text file ('name.txt') containing new text. File must be UTF-8 encoded.
+        chunkSize: Number of bytes read from the file at a time. (Defaults to 2**20)
+        keepText: True to add the text to self.text and self.cleanText. (Defaults to False)
+        ---------------------------------------------------------------------------
+        Adds the counts of a new text to the counts of the object, and updates the probabilities.
+        Replaces calling self.feedInput and self.identifyProbabilities again with all the text.
+
+        Every model which has been identified is updated. (All three, if identified with allModels=True)
+        The counts of models which have been counted, but not identified, are updated as well.
+        Only reading and counting the new text is incremental. It takes time proportional to the size of the new text.
+        The tables are rebuilt from all counts (see TransitionTable.update), so that takes time proportional to
+        the number of distinct pairs in the model. Only the states (symbols, words or contexts) which are followed
+        by a new pair get a new alias table, and the alias tables of the other states are copied.
+        If self.pruning removes words or pairs, or the pairs are counted by self.pairSketch,
+        the tables of model 3 are created again instead.
+        The text is not continued from the text fed before.
+        """
+        if not self.identified:
+            raise ValueError("You have not identified the probabilities for this data.")
+        models = tuple(model for model, table in ((1, self.symbolSampler), (2, self.pairTransitions),
+                                                  (3, self.wordTransitions)) if table is not None)
+        # Models which have been counted, but not identified, are counted as well, so they can be identified later.
+        countModels = tuple(sorted(self.countedModels.union(models)))
+        if 2 in countModels:
+            # Copy the counts. (They are read-only if the model was loaded with mmap)
+            self.pairCounts = np.array(self.pairCounts)
+            oldPairCounts = self.pairCounts.copy()
+        if 3 in countModels:
+            self.consolidateWordPairs()
+            oldKeys, oldCounts = self.wordPairKeys, self.wordPairCounts
+        oldContexts = []
+        # Pruned tables are created again, since the words and pairs removed may have changed.
+        for store in (self.symbolContexts, None if self.isPruned() else self.wordContexts):
+            if store is not None and store.transitions is not None:
+                store.consolidate()
+                oldContexts.append((store, store.pairKeys, store.pairCounts))
+        texts = self._readText(textfile, chunkSize, True, keepText, countModels)
+        if texts is not None:
+            self.text += texts[0]
+            self.cleanText += texts[1]
+        if 1 in models:
+            for key in self.alphabet:
+                self.normSymbols[key] = self.alphabet[key] / self.symbolCount
+            self.symbolSampler = AliasTable([self.alphabet[symbol] for symbol in self.symbolList])
+        if 2 in countModels:
+            self.createPairs()
+        if 2 in models:
+            self.normPairs = {}
+            self.normalizePairs()
+            # States with a new pair have changed rows.
+            changedStates = np.flatnonzero((self.pairCounts != oldPairCounts).any(axis=1))
+            firstSymbols, secondSymbols = np.nonzero(self.pairCounts)
+            self.pairTransitions.update(firstSymbols, secondSymbols, self.pairCounts[firstSymbols, secondSymbols],
+                                        len(self.symbolList), changedStates)
+            self.createBackoff(2)
+        if 3 in models and (self.isPruned() or self.pairSketch is not None):
+            self.createWordTransitions()
+        elif 3 in models:
+            firstWords, secondWords = self.splitWordPairKeys(self.wordPairKeys)
+            self.wordTransitions.update(firstWords, secondWords, self.wordPairCounts, len(self.vocabulary),
+                                        changedRows(oldKeys, oldCounts, self.wordPairKeys, self.wordPairCounts))
+            self.createBackoff(3)
+        for store, oldStoreKeys, oldStoreCounts in oldContexts:
+            store.updateTransitions(oldStoreKeys, oldStoreCounts)
+
+    @timed('identifyProbabilities')
+    def identifyProbabilities(self, sameFile=False, allModels=False, minWordCount=None, minPairCount=None, topK=None):
         """
         args:
         sameFile: Optional argument if user wants to use same file as last file.
+        allModels: True to do the calculations for all three models. (Defaults to False)
+                * Use after self.feedInput(textfile, allModels=True).
+        minWordCount: Words with a lower count are removed from the tables of model 3. (Defaults to None)
+        minPairCount: Word-pairs (or transitions between contexts) with a lower count are removed. (Defaults to None)
+        topK: Maximum number of successors kept for each word (or context). (Defaults to None)
+                * The three pruning arguments are stored in self.pruning. None keeps the stored value.
+                  (At first 1, 1 and None, so nothing is removed)
+                * The counts are not changed, so the model can be identified again with other values.
         ---------------------------------------------------------------------------
         This method handles the statistical calculations.
         The calculations are based on which text generation model the object is set to. (1, 2 or 3)
-        Nothing is shared between models in this method.
+        Nothing is shared between models in this method. See self.identifyModel.
+        The pairs are grouped by their first symbol (or word) once, so the calculations take time proportional
+        to the number of distinct pairs.
 
         Important functionality:
             ----ONLY MODEL 1----
             - Creates keys in self.normSymbols for each key(symbol) in self.alphabet.
                 * Values of keys(symbols) in self.normSymbols are normalized values of occurrences of that symbol.
+            - Creates alias table, self.symbolSampler, used to draw symbols in self.generateText.
             ----ONLY MODEL 2----
             - Creates keys in self.normPairs for each key(symbol-pair) in self.pairs.
                 * Values of keys(pairs) in self.normPairs are normalized values of occurrences of that symbol-pair.
             - Creates a numpy array, pairTableArray, consisting the transformation-probabilities for each symbol.
+                * Calculated from self.pairCounts. Rows and columns are in the order of self.symbolList.
                 * self.validTransformations contains same information, but in a dictionary.
+            - Creates a sparse table, self.pairTransitions, used to draw symbols in self.generateText.
+                * States are indices in self.symbolList.
+                * Symbols without successors back off to the symbol frequencies. See self.createBackoff.
+            - With order > 1, creates self.symbolContexts.transitions, used to draw symbols instead.
             ----ONLY MODEL 3----
-            - Creates keys in self.normWordPairs for each key(word-pair) in self.wordPairs.
-                * Values of keys(pairs) in self.normWordPairs are normalized values of occurrences of that word-pair.
-            - Creates a numpy array, wordPairTableArray, consisting the transformation-probabilities for each word.
+            - Creates a sparse table, self.wordTransitions, consisting the transformation-probabilities for each word.
+                * States are indices in self.vocabulary.
+                * Only word-pairs that occur in the text are stored. See TransitionTable.
+                * Words without successors back off to the word frequencies. (self.normWords)
                 * self.validWordTransformations contains same information, but in a dictionary.
+                  (Each word maps to a dictionary of the following words and their probabilities)
+                * self.normWordPairs contains normalized values of occurrences of each word-pair.
+                  (Both dictionaries are only created when used)
+            - With order > 1, creates self.wordContexts.transitions, used to draw words instead.
+            - Removes rare words and pairs from both tables, if set by the pruning arguments. (See prunePairs)
+                * The numbers of states, pairs and counts kept are stored in self.pruningStats.
         """
         if not self.defined:
             raise ValueError("You have not defined an alphabet for this object.")
         if not self.fed:
             raise ValueError("You have not fed any input to this object.")
+        for name, value in (('minWordCount', minWordCount), ('minPairCount', minPairCount), ('topK', topK)):
+            if value is not None and value < 1:
+                raise ValueError(name + " must be int 1 or more")
+        models = (1, 2, 3) if allModels else (self.model,)
+        # Contexts of self.order tokens need one more token to have a transition.
+        for model, tokenName, tokenCount in ((2, "symbols", self.symbolCount), (3, "words", self.wordCount)):
+            if self.order > 1 and model in models and tokenCount <= self.order:
+                raise ValueError("order ({0}) must be less than the number of {1} in the text ({2})".format(
+                    self.order, tokenName, tokenCount))
         if self.identified and not sameFile:
             self.normSymbols = {}
             self.normPairs = {}
-            self.normWordPairs = {}
             self.pairTableArray = None
-            self.wordPairTableArray = None
+            self.symbolSampler = None
+            self.pairTransitions = None
+            self.wordTransitions = None
+        for name, value in (('minWordCount', minWordCount), ('minPairCount', minPairCount), ('topK', topK)):
+            if value is not None:
+                self.pruning[name] = value
         self.identified = True
-        if self.model == 1:
+        for model in models:
+            self.identifyModel(model)
+
+    @timed('identifyModel')
+    def identifyModel(self, model):
+        """
+        args:
+        model: Int 1, 2 or 3. Model to do the calculations for.
+        ---------------------------------------------------------------------------
+        Does the calculations of self.identifyProbabilities for one model.
+        """
+        if model == 1:
             for key in self.alphabet:
                 # Create keys in self.normSymbols for each key(symbol) in self.alphabet.
                 self.normSymbols[key] = self.alphabet[key] / self.symbolCount
-            if __debug__:
+            # Create alias table for drawing symbols. Index of the table is index in self.symbolList.
+            self.symbolSampler = AliasTable([self.alphabet[symbol] for symbol in self.symbolList])
+            if self.validate:
                 print "~"*80
                 print "Tests for identifyProbabilities method:"
                 flag = True
@@ -341,38 +2563,16 @@ class AutomaticTextGenerator(object):
 
                 print "The values of self.normSymbols accumulate to 1.0,", \
                     0.9999 < sum(self.normSymbols.values()) <= 1.0001
-        elif self.model == 2:
-            # Calculate normalization factor.
-            normFact = sum(self.pairs.values())
-            for key in self.pairs:
-                # Create keys in self.normPairs for each key(symbol-pair) in self.pairs.
-                self.normPairs[key] = self.pairs[key] / normFact
-            for i in self.alphabet:
-                validNextSymbols = {}
-                for key in self.normPairs:
-                    if key[0] == i and self.pairs[key] > 0:
-                        # For each symbol in alphabet:
-                        # Create keys in temporary dictionary, validNextSymbols.
-                        # Keys are pairs of symbols, which first symbol is the same as the symbol from alphabet.
-                        validNextSymbols[key] = self.normPairs[key]
-                # Calculate normalization factor for validNextSymbols.
-                normFact = sum(validNextSymbols.values())
-                for j in self.alphabet:
-                    pair = i + j
-                    if pair in validNextSymbols:
-                        # Append normalized values of validNextSymbols to the dict self.validTransformations.
-                        self.validTransformations[i].append(validNextSymbols[pair] / normFact)
-                    else:
-                        # Also append values of rest of the pairs to maintain order in self.validTransformations.
-                        self.validTransformations[i].append(0.0)
-            # Create array, self.pairTableArray containing same information as self.validTransformations. Used to plot.
-            symbolPairTable = []
-            for i in self.validTransformations:
-                symbolPairTable.append(self.validTransformations[i])
-            # Delete unwanted empty list. (Mysterious extra symbol)
-            del symbolPairTable[-1]
-            self.pairTableArray = np.array(symbolPairTable)
-            if __debug__:
+        elif model == 2:
+            self.normalizePairs()
+            # Create sparse table, self.pairTransitions, used to draw symbols.
+            firstSymbols, secondSymbols = np.nonzero(self.pairCounts)
+            self.pairTransitions = TransitionTable(firstSymbols, secondSymbols,
+                                                   self.pairCounts[firstSymbols, secondSymbols], len(self.symbolList))
+            self.createBackoff(2)
+            if self.symbolContexts is not None:
+                self.symbolContexts.createTransitions()
+            if self.validate:
                 print "~"*80
                 print "Tests for identifyProbabilities method:"
                 flag = True
@@ -402,42 +2602,26 @@ class AutomaticTextGenerator(object):
                 elif not flag:
                     print "All valid values of self.validTransformations accumulate to 1.0, False"
 
-        elif self.model == 3:
-            for key in self.words:
-                self.normWords[key] = self.words[key] / len(self.words)
-            # Calculate normalization factor.
-            normFact = sum(self.wordPairs.values())
-            for key in self.wordPairs:
-                # Create keys in self.normWordPairs for each key(word-pair) in self.wordPairs.
-                self.normWordPairs[key] = self.wordPairs[key] / normFact
-            n = 0
-            for i in self.words:
-                validNextWords = {}
-                for key in self.normWordPairs:
-                    if key[0] == i and self.wordPairs[key] > 0:
-                        # For each word in self.words:
-                        # Create keys in temporary dictionary, validNextWords.
-                        # Keys are pairs of words, which first word is the same as the word from self.words.
-                        validNextWords[key] = self.normWordPairs[key]
-                # Calculate normalization factor for validNextWords.
-                normFact = sum(validNextWords.values())
-                for j in self.words:
-                    wordPair = (i, j)
-                    if wordPair in validNextWords:
-                        # Append normalized values of validNextWords to the dict self.validWordTransformations.
-                        self.validWordTransformations[i].append(validNextWords[wordPair] / normFact)
-                    else:
-                        # Also append values of rest of the pairs to maintain order in self.validWordTransformations.
-                        self.validWordTransformations[i].append(0.0)
-            # Create array, self.wordPairTableArray containing same information as self.validWordTransformations.
-            # Used to plot.
-            wordPairTable = []
-            for i in self.validWordTransformations:
-                wordPairTable.append(self.validWordTransformations[i])
-            self.wordPairTableArray = np.array(wordPairTable)
-            if __debug__:
+        elif model == 3:
+            # Create sparse table, self.wordTransitions, with the transformation-probabilities for each word.
+            self.createWordTransitions()
+            if self.validate:
                 print "~"*80
                 print "Tests for identifyProbabilities method:"
+                if self.pairSketch is not None:
+                    print "Word-pairs are counted by a sketch. Error bounds:", self.pairSketch.errorBounds()
+                    # The size of the table is fixed by the sketch, and the backoff is only stored once.
+                    table = self.wordTransitions
+                    backoffSize = (0 if table.fallback is None else len(table.fallbackStates)) + \
+                        (0 if table.backoff is None else table.backoff.nnz())
+                    print "The number of word-pairs({0}) is at most the capacity of the sketch,".format(table.nnz()), \
+                        table.nnz() <= self.pairSketch.capacity
+                    print "The size of the backoff({0}) is at most the number of words,".format(backoffSize), \
+                        backoffSize <= len(self.vocabulary)
+                for tableName, tableStats in sorted(self.pruningStats.iteritems()):
+                    print "Pruning of {0} kept {1} of {2} pairs, and {3} of {4} states.".format(
+                        tableName, tableStats['keptPairs'], tableStats['pairs'], tableStats['keptStates'],
+                        tableStats['states'])
                 flag = True
                 for i in self.wordPairs:
                     if i in self.normWordPairs:
@@ -452,7 +2636,7 @@ class AutomaticTextGenerator(object):
                     0.9999 < sum(self.normWordPairs.values()) <= 1.0001
                 flag = True
                 for i in self.words:
-                    vals = self.validWordTransformations[i]
+                    vals = self.validWordTransformations[i].values()
                     if sum(vals) > 0:
                         if 0.9999 < sum(vals) <= 1.0001:
                             continue
@@ -465,23 +2649,210 @@ class AutomaticTextGenerator(object):
                 elif not flag:
                     print "All valid values of self.validWordTransformations accumulate to 1.0, False"
 
+    def createWordTransitions(self):
+        """
+        Creates the sparse table, self.wordTransitions, with the transformation-probabilities for each word,
+        and self.wordContexts.transitions when order > 1. Rare words and pairs are removed first, by self.pruning.
+        """
+        firstWords, secondWords = self.splitWordPairKeys(self.wordPairKeys)
+        keepWords = None
+        if self.pruning['minWordCount'] > 1:
+            keepWords = np.asarray(self.wordCounts) >= self.pruning['minWordCount']
+        firstWords, secondWords, counts, self.pruningStats['wordTransitions'] = prunePairs(
+            firstWords, secondWords, self.wordPairCounts, len(self.vocabulary), keepWords,
+            self.pruning['minPairCount'], self.pruning['topK'])
+        self.wordTransitions = createTransitionTable(firstWords, secondWords, counts, len(self.vocabulary),
+                                                     self.cacheSize)
+        self.createBackoff(3)
+        if self.wordContexts is not None:
+            self.pruningStats['wordContexts'] = self.wordContexts.createTransitions(
+                keepWords, self.pruning['minPairCount'], self.pruning['topK'])
+        for tableStats in self.pruningStats.values():
+            self.stats.count('prunedPairs', tableStats['pairs'] - tableStats['keptPairs'])
+        self.wordViews = {}
+
+    def isPruned(self):
+        """
+        return:
+        True if self.pruning removes any words or pairs.
+        """
+        return self.pruning['minWordCount'] > 1 or self.pruning['minPairCount'] > 1 or self.pruning['topK'] is not None
+
+    def createBackoff(self, model):
+        """
+        args:
+        model: Int 2 or 3.
+        ---------------------------------------------------------------------------
+        Sets the fallback of self.pairTransitions (model 2) or self.wordTransitions (model 3).
+        A symbol or word without successors (the last of the text) backs off to the frequencies of the symbols
+        or words which have successors, so generated texts continue instead of starting again with a new pair.
+        The frequencies are the same for every dead end, so they are precomputed once in one shared alias table.
+        (See TransitionTable.setFallback)
+        """
+        if model == 2:
+            transitions = self.pairTransitions
+            counts = np.array([self.alphabet[symbol] for symbol in self.symbolList], dtype=np.int64)
+        else:
+            transitions = self.wordTransitions
+            counts = np.asarray(self.wordCounts, dtype=np.int64)
+        # Back off to the states with successors, weighted by their number of occurrences.
+        targets = np.flatnonzero((transitions.rowTotals > 0) & (counts > 0))
+        if len(transitions.deadEnds()) == 0:
+            # Not needed if every state which is reached has successors.
+            targets = targets[:0]
+        transitions.setFallback(targets, counts[targets])
+
+    @timed('generateText')
     def generateText(self, N):
         """
         args:
         N: Amount of symbols, pairs or word-pairs to generate.
         ---------------------------------------------------------------------------
-        Generate a new text by using one of the three text generating models.
+        Generate a new text by using one of the three text generating models, and store it in self.newtext.
+        The symbols or words are drawn by self.iterGenerate(N).
+        Model 1 draws all N symbols at once instead, with one block of random numbers.
+        """
+        self.checkGenerate(N)
+        # If model is 1
+        # Draw N independent symbols from self.symbolSampler at once.
+        # The indices are converted to code points and decoded, so no loop over the symbols is needed.
+        if self.model == 1:
+            codes = self.symbolSampler.drawMany(self.rng.random_sample(N))
+            self.stats.count('draws', N)
+            codePoints = np.array([ord(i) for i in self.symbolList], dtype='<u4')
+            self.newtext = codePoints[codes].tostring().decode('utf-32-le')
+        # If model is 2 or 3
+        # Join the symbols from self.iterGenerate. Model 3 adds a space after each word.
+        else:
+            separator = u"" if self.model == 2 else u" "
+            self.newtext = u"".join([i + separator for i in self.iterGenerate(N)])
+        # Tests
+        if self.validate:
+            if self.model == 3:
+                newTextList = self.newtext.split()
+            else:
+                newTextList = self.newtext
+            print "~"*80
+            print "Tests for generated text:"
+            print "Number of symbols in self.newtext is equal to N({0}),".format(N), len(newTextList) == N
+            if self.model != 1:
+                textPairs, restarts = self.textPairs()
+                generatedPairs = zip(newTextList[:-1], newTextList[1:])
+                print "All pairs of symbols (or words) in self.newtext occur in the text,", \
+                    "(Except after starting again)", \
+                    all(pair in textPairs or pair[0] in restarts for pair in generatedPairs)
 
-        Inner functions:
-            -f- isEqual(list)
-                |Checks if every element in list is equal
-            -f- getSymbol()
-                |Find initial symbol
-                |Model 1 only uses this method, because the symbols are independent from previous symbols.
-                |getSymbol() returns string if model = 1 or 2, and returns tuple if model = 3
-            -f- getNextSymbol(prevSymbol)
-                |Find all probable symbols (pairs or words) dependent on argument prevSymbol.
-                |Not used by model 1
+    @timed('generateToFile')
+    def generateToFile(self, filename, N, bufferSize=2**16):
+        """
+        args:
+        filename: Name of file to write to. ('name.txt') Written UTF-8 encoded.
+        N: Amount of symbols or words to generate.
+        bufferSize: Number of symbols or words written to the file at a time. (Defaults to 2**16)
+        ---------------------------------------------------------------------------
+        Generate a new text like self.generateText, but write it to a file while it is generated.
+        Memory use does not depend on N. self.newtext is not changed.
+        """
+        self.checkGenerate(N)
+        separator = u" " if self.model == 3 else u""
+        with codecs.open(filename, 'w', encoding='UTF-8') as newFile:
+            buffer = []
+            for i in self.iterGenerate(N):
+                buffer.append(i + separator)
+                if len(buffer) >= bufferSize:
+                    newFile.write(u"".join(buffer))
+                    buffer = []
+            newFile.write(u"".join(buffer))
+
+    @timed('generateChains')
+    def generateChains(self, B, N):
+        """
+        args:
+        B: Amount of independent texts (chains) to generate.
+        N: Amount of symbols or words in each text.
+        return:
+        List of B generated texts.
+        ---------------------------------------------------------------------------
+        Generate many texts at once with model 2 or 3, stepping all B chains together.
+        Each step draws the next state of every chain with one call to self.pairTransitions.drawNextMany
+        (or self.wordTransitions), so the cost of each step in python is shared by the B chains.
+        A chain that reaches a state without successors continues from the backoff table (or the fallback),
+        like self.generateText.
+        self.newtext is not changed.
+        """
+        self.checkGenerate(N)
+        if self.model == 1:
+            raise ValueError("generateChains is only used by model 2 and 3. Use generateBatch for model 1.")
+        transitions = self.pairTransitions if self.model == 2 else self.wordTransitions
+        store = self.getContextStore()
+        if store is not None:
+            transitions = store.transitions
+        hasSuccessors = np.diff(transitions.indptr) > 0
+        # tokens[n] is the state of every chain after n steps.
+        tokens = np.empty((N, B), dtype=np.int32)
+        states = transitions.drawStartMany(self.rng.random_sample(B))
+        tokens[0] = states
+        self.stats.count('draws', N * B)
+        for n in range(1, N):
+            # Chains in a state without successors back off. Counted as fallback draws.
+            self.stats.count('fallbackDraws', np.count_nonzero(~hasSuccessors[states]))
+            states = transitions.drawNextMany(states, self.rng.random_sample(B))
+            tokens[n] = states
+        chains = tokens.T
+        if store is not None:
+            # The states are contexts. The first context yields all its tokens, the others their last token.
+            # (Or more, after backing off. See store.walkTokens)
+            previous = np.vstack((np.full(B, -1, dtype=np.int32), tokens[:-1])).T
+            chains = [store.walkTokens(before, chain)[:N] for before, chain in zip(previous, chains)]
+        # Decode the chains. Model 2 decodes code points like model 1 in self.generateText.
+        if self.model == 2:
+            codePoints = np.array([ord(i) for i in self.symbolList], dtype='<u4')
+            return [codePoints[chain].tostring().decode('utf-32-le') for chain in chains]
+        words = np.array(list(self.vocabulary), dtype=object)
+        return [u" ".join(words[chain]) + u" " for chain in chains]
+
+    def getContextStore(self):
+        """
+        return:
+        The ContextStore used to generate text with the current model, or None if order is 1 or model is 1.
+        """
+        if self.model == 2:
+            return self.symbolContexts
+        if self.model == 3:
+            return self.wordContexts
+        return None
+
+    def textPairs(self):
+        """
+        return:
+        Tuple of sets. (pairs of symbols or words which occur in the text,
+                        symbols or words after which the generated text may start again)
+        ---------------------------------------------------------------------------
+        Used by the tests of self.generateText, for model 2 and 3.
+        The pairs are read from the contexts if order > 1. The text starts again after a state without successors,
+        which backs off to all states. (See ContextStore.createBackoff and TransitionTable.setFallback)
+        """
+        keys = self.symbolList if self.model == 2 else self.vocabulary
+        store = self.getContextStore()
+        if store is not None:
+            firsts, seconds = store.contexts[:, :-1].ravel(), store.contexts[:, 1:].ravel()
+            deadEnds = store.transitions.deadEnds()
+            restarts = store.contexts[deadEnds[store.firstTokens[deadEnds] == 0], -1]
+        elif self.model == 2:
+            firsts, seconds = np.nonzero(self.pairCounts)
+            restarts = self.pairTransitions.deadEnds()
+        else:
+            firsts, seconds = self.splitWordPairKeys(self.wordPairKeys)
+            restarts = self.wordTransitions.deadEnds()
+        return set((keys[i], keys[j]) for i, j in zip(firsts.tolist(), seconds.tolist())), \
+            set(keys[i] for i in restarts.tolist())
+
+    def checkGenerate(self, N):
+        """
+        args:
+        N: Amount of symbols to generate, or None for no limit.
+        ---------------------------------------------------------------------------
+        Raises ValueError if the object is not ready to generate text.
         """
         if not self.defined:
             raise ValueError("You have not defined an alphabet for this object.")
@@ -489,360 +2860,133 @@ class AutomaticTextGenerator(object):
             raise ValueError("You have not fed any input to this object.")
         if not self.identified:
             raise ValueError("You have not identified the probabilities for this data.")
-        if N <= 1:
+        if N is not None and N <= 1:
             raise ValueError("N must a positive integer over 0")
 
-        def isEqual(list):
-            """
-            --INNER FUNCTION--
-            args:
-            list: List to check
-            return:
-            True: if elements in list are equal.
-            False: if elements in list are not equal.
-            ---------------------------------------------------------------------------
-            Checks if elements in list are equal
-            """
-            # Compare all elements in list to first element.
-            if len(list) > 0:
-                comparer = list[0]
-                for i in list:
-                    if i != comparer:
-                        return False
-                return True
-            else:
-                return True
+    def iterGenerate(self, N=None):
+        """
+        args:
+        N: Amount of symbols or words to generate. (Defaults to None, which generates symbols until stopped)
+        return:
+        Generator yielding the new symbols (model 1 and 2) or words (model 3) one at a time.
+        ---------------------------------------------------------------------------
+        Generate a new text by using one of the three text generating models.
+        Each symbol is yielded as soon as it is drawn, so the first symbol arrives at once,
+        and memory use does not depend on N.
+
+        Inner functions:
+            -f- generate()
+                |The generator returned by this method.
 
-        def getSymbol():
+        Model 2 and 3 walk through the states of the transition table with transitions.walk(state, u),
+        drawing one state for each random float in u. The states are walked in blocks, which start small,
+        so the first symbols arrive at once, and grow to 2**16 states, so the walk can be compiled. (See walkStates)
+        Symbols are drawn as indices into parallel arrays of keys and probabilities,
+        so equal probabilities are drawn with correct frequencies, and no key has to be looked up by its value.
+        """
+        self.checkGenerate(N)
+        # Find the table of transformation-probabilities, and the keys of its states, for models 2 and 3.
+        if self.model == 2:
+            transitions, keys = self.pairTransitions, self.symbolList
+        elif self.model == 3:
+            transitions, keys = self.wordTransitions, self.vocabulary
+        store = self.getContextStore()
+        if store is not None:
+            # The states are contexts of self.order tokens. Each context yields its last token. (See store.walkTokens)
+            transitions = store.transitions
+        if self.model != 1:
+            hasSuccessors = np.diff(transitions.indptr) > 0
+
+        def generate():
             """
             --INNER FUNCTION--
             ---------------------------------------------------------------------------
-            Get symbol independent of previous symbol.
+            Yields N symbols using either one of the 3 text generation models.
             """
-            valList = []
-            # Append values from self.normSymbols if model = 1.
-            if self.model == 1:
-                for key in self.normSymbols:
-                    valList.append(self.normSymbols[key])
-                # Tests
-                if __debug__:
-                    if len(valList) != len(self.normSymbols):
-                        print "~"*80
-                        print "Error in getSymbol()"
-                        print "Length of valList({0}) is equal to length of normSymbols({1}), False".format(
-                            len(valList), len(self.normSymbols))
-            # Append values from self.normPairs if model = 2.
-            elif self.model == 2:
-                for key in self.normPairs:
-                    valList.append(self.normPairs[key])
-                # Tests
-                if __debug__:
-                    if len(valList) != len(self.normPairs):
-                        print "~"*80
-                        print "Error in getSymbol()"
-                        print "Length of valList({0}) is equal to length of normPairs({1}), False".format(
-                            len(valList), len(self.normPairs))
-            # Append values from self.normWordPairs if model = 3.
-            elif self.model == 3:
-                for key in self.normWordPairs:
-                    valList.append(self.normWordPairs[key])
-                # Tests
-                if __debug__:
-                    if len(valList) != len(self.normWordPairs):
-                        print "~"*80
-                        print "Error in getSymbol()"
-                        print "Length of valList({0}) is equal to length of normWordPairs({1}), False".format(
-                            len(valList), len(self.normWordPairs))
-            # Shared code for all models
-            # Sort values
-            valList.sort()
-            accSum, sumChain = 0, []
-            # Create list, sumChain, containing elements of accumulated values before that element.
-            # We're interested in the intervals between the elements.
-            for i in range(len(valList)):
-                sumChain.append(accSum)
-                accSum += valList[i]
-            # Tests
-            if __debug__:
-                if len(sumChain) != len(valList):
-                    print "~"*80
-                    print "Error in getSymbol()"
-                    print "Length of valList({0}) is equal to length of sumChain({1}), False".format(
-                        len(valList), len(sumChain))
-            # Generate random float between 0 and 1 and store in variable z.
-            z, k, val = random.random(), 0, 0
-            symbol = ""
-            for i in sumChain:
-                if i <= z:
-                    # Save/overwrite value from index k in valList if element in sumChain is smaller than z.
-                    # This works because index in valList is the same as the index of sumChain.
-                    val = valList[k]
-                k += 1
+            n = 0
+            blockSize = 2**8
             # If model is 1
-            # Return the symbol from self.normSymbols that has the same value as previously found value(val).
+            # Draw blocks of independent symbols from self.symbolSampler.
             if self.model == 1:
-                for key in self.normSymbols:
-                    if val == self.normSymbols[key]:
-                        symbol = key
-                # Tests
-                if __debug__:
-                    if type(symbol) != unicode or len(symbol) != 1:
-                        print "~"*80
-                        print "Error in getSymbol()"
-                        print "Symbol is not of correct format."
-                return symbol
-            # If model is 2
-            # Return the symbol-pair from self.normPairs that has the same value as previously found value(val).
-            if self.model == 2:
-                for key in self.normPairs:
-                    if val == self.normPairs[key]:
-                        symbol = key
-                # Tests
-                if __debug__:
-                    if type(symbol) != unicode or len(symbol) != 2:
-                        print "~"*80
-                        print "Error in getSymbol()"
-                        print "Symbol is not of correct format."
-                return symbol
-            # If model is 3
-            # Return the word-pair from self.normWordPairs that has the same value as previously found value(val).
-            if self.model == 3:
-                for key in self.normWordPairs:
-                    if val == self.normWordPairs[key]:
-                        symbol = key
-                # Tests
-                if __debug__:
-                    if type(symbol) != tuple or len(symbol) != 2:
-                        print "~"*80
-                        print "Error in getSymbol()"
-                        print "Symbol is not of correct format."
-                return symbol
-
-        def getNextSymbol(prevSym):
-            """
-            --INNER FUNCTION--
-            args:
-            symbol: Previous symbol
-            ---------------------------------------------------------------------------
-            Get symbol dependent of last symbol.
-            Not used by model 1.
-            """
-            valList = []
-            transDict = {}
-            # If model is 2
-            if self.model == 2:
-                transformations = None
-                for i in self.validTransformations:
-                    if i == prevSym:
-                        # Find transformation-probability array for previous symbol.
-                        transformations = self.validTransformations[i]
-                n = 0
-                for key in self.alphabet:
-                    # Create keys in temporary dictionary transDict.
-                    # Key is symbol from alphabet. Value is that symbols probability from transformations array.
-                    # This works because index in transformations array matches keys in alphabet.
-                    transDict[key] = transformations[n]
-                    n += 1
-                # Tests
-                if __debug__:
-                    if len(transDict) != len(self.alphabet):
-                        print "~"*80
-                        print "Error in getNextSymbol()"
-                        print "Length of transDict is not equal to length of self.alphabet."
-            # If model is 3
-            if self.model == 3:
-                transformations = None
-                for i in self.validWordTransformations:
-                    if i == prevSym:
-                        # Find transformation-probability array for previous word.
-                        transformations = self.validWordTransformations[i]
-                n = 0
-                for key in self.words:
-                    # Create keys in temporary dictionary transDict.
-                    # Key is word from self.words. Value is that words probability from transformations array.
-                    # This works because index in transformations array matches keys in self.words.
-                    transDict[key] = transformations[n]
-                    n += 1
-                # Tests
-                if __debug__:
-                    if len(transDict) != len(self.words):
-                        print "~"*80
-                        print "Error in getNextSymbol()"
-                        print "Length of transDict is not equal to length of self.words."
-
-            # Shared code for all models.
-            # Append all values to valList from transDict if that value is greater than 0.
-            for key in transDict:
-                if transDict[key] > 0:
-                    valList.append(transDict[key])
-            # Sort valList
-            valList.sort()
-            # Create list, sumChain, containing elements of accumulated values before that element.
-            # We're interested in the intervals between the elements.
-            accSum, sumChain = 0, []
-            for i in range(len(valList)):
-                sumChain.append(accSum)
-                accSum += valList[i]
-            # Tests
-            if __debug__:
-                if len(sumChain) != len(valList):
-                    print "~"*80
-                    print "Error in getNextSymbol()"
-                    print "Length of valList({0}) is not equal to length of sumChain({1})".format(
-                        len(valList), len(sumChain))
-            # Generate random float between 0 and 1 and store in variable z.
-            z, k, val = random.random(), 0, 0
-            symbol = ""
-            for i in sumChain:
-                if i <= z:
-                    # Save/overwrite value from index k in valList if element in sumChain is smaller than z.
-                    # This works because index in valList is the same as the index of sumChain.
-                    val = valList[k]
-                k += 1
-            # If model is 2
-            # Return the symbol-pair from transDict that has the same value as previously found value(val).
-            # If values in valList are equal pick random key from transDict using random module.
-            if self.model == 2:
-                if not isEqual(valList):
-                    for key in transDict:
-                        if val == transDict[key]:
-                            symbol = prevSym + key
-                            # Tests
-                            if __debug__:
-                                if type(symbol) != unicode or len(symbol) != 2:
-                                    print "~"*80
-                                    print "Error in getNextSymbol()"
-                                    print "Symbol is not of correct format."
-                    return symbol
-                else:
-                    validKeys = []
-                    for key in transDict:
-                        if transDict[key] > 0:
-                            validKeys.append(key)
-                    key = random.choice(validKeys)
-                    symbol = prevSym + key
-                    # Tests
-                    if __debug__:
-                        if type(symbol) != unicode or len(symbol) != 2:
-                            print "~"*80
-                            print "Error in getNextSymbol()"
-                            print "Symbol is not of correct format."
-                    return symbol
-            # If model is 3
-            # Return the word-pair from transDict that has the same value as previously found value(val).
-            # If values in valList are equal pick random key from transDict using random module.
-            elif self.model == 3:
-                if not isEqual(valList):
-                    for key in transDict:
-                        if val == transDict[key]:
-                            symbol = (prevSym, key)
-                            # Tests
-                            if __debug__:
-                                if type(symbol) != tuple or len(symbol) != 2:
-                                    print "~"*80
-                                    print "Error in getNextSymbol()"
-                                    print "Symbol is not of correct format."
-                    return symbol
-                else:
-                    validKeys = []
-                    for key in transDict:
-                        if transDict[key] > 0:
-                            validKeys.append(key)
-                    key = random.choice(validKeys)
-                    symbol = (prevSym, key)
-                    # Tests
-                    if __debug__:
-                        if type(symbol) != tuple or len(symbol) != 2:
-                            print "~"*80
-                            print "Error in getNextSymbol()"
-                            print "Symbol is not of correct format."
-                    return symbol
-        #########################################################################################
-        # Following code generates N symbols using either one of the 3 text generation models.  #
-        #########################################################################################
-        #
-        # Clear self.newtext
-        self.newtext = ""
-        # If model is 1
-        # Only call getSymbol() to generate new symbols
-        if self.model == 1:
-            for i in range(N):
-                self.newtext += getSymbol()
-            # Tests
-            if __debug__:
-                print "~"*80
-                print "Tests for generated text:"
-                print "Number of symbols in self.newtext is equal to N({0}),".format(N), len(self.newtext) == N
-        # If model is 2
-        # Call getSymbol() to find first symbol. Then call getNextSymbol(first symbol) to find second symbol.
-        # Call getNextSymbol(previous symbols) N-2 times.
-        if self.model == 2:
-            firstPair = getSymbol()
-            self.newtext += firstPair[0]
-            nextPair = getNextSymbol(firstPair[1])
-            self.newtext += nextPair[0]
-            lastPair = nextPair
-            # Tests
-            if __debug__:
-                if firstPair[1] != nextPair[0]:
-                    print "~"*80
-                    print "Tests for generated text:"
-                    print "Error. firstPair[1]('{0}') does not match nextPair[0]('{1}').".format(
-                        firstPair[1], nextPair[0])
-                    if firstPair[1] + nextPair[1] not in self.pairs:
-                        print "Error. Pair ({0}) does not exist.".format(lastPair[1] + nextPair[1])
-            for i in range(N-2):
-                nextPair = getNextSymbol(lastPair[1])
-                self.newtext += nextPair[0]
-                # Tests
-                if __debug__:
-                    if lastPair[1] != nextPair[0]:
-                        print "~"*80
-                        print "Error. lastPair[1]('{0}') does not match nextPair[0]('{1}').".format(
-                            lastPair[1], nextPair[0])
-                    if lastPair[1] + nextPair[1] not in self.pairs:
-                        print "Error. Pair ({0}) does not exist.".format(lastPair[1] + nextPair[1])
-                # nextPair now stored in last pair
-                lastPair = nextPair
-            if __debug__:
-                print "~"*80
-                print "Tests for generated text:"
-                print "Number of symbols in self.newtext is equal to N({0}),".format(N), len(self.newtext) == N
-        # If model is 3
-        # Call getSymbol() to find first word. Then call getNextSymbol(first word) to find second word.
-        # Call getNextSymbol(previous word) N-2 times, to find the following words.
-        if self.model == 3:
-            firstPair = getSymbol()
-            self.newtext += firstPair[0] + " "
-            nextPair = getNextSymbol(firstPair[1])
-            self.newtext += nextPair[0] + " "
-            lastPair = nextPair
-            # Tests
-            if __debug__:
-                if firstPair[1] != nextPair[0]:
-                    print "~"*80
-                    print "Tests for generated text:"
-                    print "Error. firstPair[1]('{0}') does not match nextPair[0]('{1}').".format(
-                        firstPair[1], nextPair[0])
-            for i in range(N-2):
-                nextPair = getNextSymbol(lastPair[1])
-                self.newtext += nextPair[0] + " "
-                # Tests
-                if __debug__:
-                    if lastPair[1] != nextPair[0]:
-                        print "~"*80
-                        print "Tests for generated text:"
-                        print "Error. lastPair[1]('{0}') does not match nextPair[0]('{1}').".format(
-                            lastPair[1], nextPair[0])
-                    if (lastPair[1], nextPair[1]) not in self.wordPairs:
-                        print "Error. Pair ({0}) does not exist.".format((lastPair[1], nextPair[1]))
-                # nextPair now stored in last pair
-                lastPair = nextPair
-            if __debug__:
-                newTextList = self.newtext.split()
-                print "~"*80
-                print "Tests for generated text:"
-                print "Number of words in self.newtext is equal to N({0}),".format(N), len(newTextList) == N
+                while N is None or n < N:
+                    size = blockSize if N is None else min(blockSize, N - n)
+                    self.stats.count('draws', size)
+                    for i in self.symbolSampler.drawMany(self.rng.random_sample(size)).tolist():
+                        yield self.symbolList[i]
+                    n += size
+                    blockSize = min(2 * blockSize, 2**16)
+            # If model is 2 or 3
+            # Walk from a start state (-1), and continue each block from the last state of the block before.
+            else:
+                state = -1
+                while N is None or n < N:
+                    size = blockSize if N is None else min(blockSize, N - n)
+                    states = transitions.walk(state, self.rng.random_sample(size))
+                    # Each step from a state without successors backs off (or starts again). Counted as fallback draws.
+                    previous = np.concatenate(([state], states[:-1])) if state >= 0 else states[:-1]
+                    self.stats.count('draws', size)
+                    self.stats.count('fallbackDraws', np.count_nonzero(~hasSuccessors[previous]))
+                    if store is not None:
+                        # The first context, and contexts drawn by backing off, yield more than their last token.
+                        tokens = [keys[i] for i in store.walkTokens(np.concatenate(([state], states[:-1])),
+                                                                    states).tolist()]
+                        if N is not None:
+                            tokens = tokens[:N - n]
+                    else:
+                        tokens = [keys[i] for i in states.tolist()]
+                    for token in tokens:
+                        yield token
+                    n += len(tokens)
+                    state = int(states[-1])
+                    blockSize = min(2 * blockSize, 2**16)
+        return generate()
+
+    @timed('generateBatch')
+    def generateBatch(self, nTexts, N, workers=None):
+        """
+        args:
+        nTexts: Amount of texts to generate.
+        N: Amount of symbols or words in each text.
+        workers: Amount of worker processes. (Defaults to None, which uses one per core)
+        return:
+        List of nTexts generated texts.
+        ---------------------------------------------------------------------------
+        Generate many independent texts in parallel with a pool of processes.
+        Each text gets its own seed drawn from self.rng, so a batch is reproducible with the same seed,
+        and does not depend on the amount of workers.
+        The model is shared read-only by the workers, and self.newtext is not changed.
+        """
+        self.checkGenerate(N)
+        seeds = self.rng.randint(0, 2**31 - 1, size=nTexts).tolist()
+        tasks = [(seed, N, self.model) for seed in seeds]
+        if workers == 1:
+            # No pool is needed for one worker. Generate from a copy of the state in this process.
+            global batchGenerator
+            model, rng, newtext = self.model, self.rng, self.newtext
+            batchGenerator = self
+            try:
+                return map(batchWorker, tasks)
+            finally:
+                self.model, self.rng, self.newtext = model, rng, newtext
+                batchGenerator = None
+        path = None
+        if hasattr(os, 'fork'):
+            # The workers inherit self when forked.
+            pool = multiprocessing.Pool(workers, initBatchWorker, (self,))
+        else:
+            # The workers load a memory-mapped copy of the model instead of unpickling self.
+            path = tempfile.mkdtemp()
+            self.saveModel(path)
+            pool = multiprocessing.Pool(workers, initBatchWorker, (None, path))
+        try:
+            chunkSize = max(1, nTexts // (4 * (workers or multiprocessing.cpu_count())))
+            return pool.map(batchWorker, tasks, chunkSize)
+        finally:
+            pool.close()
+            pool.join()
+            if path is not None:
+                shutil.rmtree(path)
+
     def saveText(self, name):
         """
         args:
@@ -857,15 +3001,184 @@ class AutomaticTextGenerator(object):
         with codecs.open(filename, 'w', encoding='UTF-8') as newFile:
             newFile.write(self.newtext)
 
-    def visualizeData(self, model, show=0, save=0):
+    @timed('saveModel')
+    def saveModel(self, path):
+        """
+        args:
+        path: Name of directory to save model in. Created if it does not exist.
+        ---------------------------------------------------------------------------
+        Saves the alphabet, vocabulary, counts and tables of every model the object has been fed and identified for.
+        Each numpy array is saved in its own '.npy' file, so self.loadModel can memory-map them.
+        The file 'model.json' contains the symbols, the letters, and the names of the saved arrays.
+        Files are replaced and not overwritten, so a model loaded from path can be saved to path again.
+        """
+        if not self.defined:
+            raise ValueError("You have not defined an alphabet for this object.")
+        if not self.fed:
+            raise ValueError("You have not fed any input to this object.")
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.consolidateWordPairs()
+        # Collect all arrays to save in dictionary arrays.
+        arrays = {'symbolCounts': np.array([self.alphabet[i] for i in self.symbolList], dtype=np.int64)}
+        if self.symbolSampler is not None:
+            arrays['symbolSampler.aliasProbs'] = self.symbolSampler.aliasProbs
+            arrays['symbolSampler.aliasIndices'] = self.symbolSampler.aliasIndices
+        if self.pairCounts is not None:
+            arrays['pairCounts'] = self.pairCounts
+        if len(self.vocabulary) > 0:
+            # Store vocabulary as UTF-8 encoded words one after another, and the position of each word.
+            encodedWords = [word.encode('UTF-8') for word in self.vocabulary]
+            offsets = np.zeros(len(encodedWords) + 1, dtype=np.int64)
+            np.cumsum([len(word) for word in encodedWords], out=offsets[1:])
+            arrays['vocabulary.data'] = np.frombuffer("".join(encodedWords), dtype=np.uint8)
+            arrays['vocabulary.offsets'] = offsets
+            arrays['wordCounts'] = self.wordCounts
+            arrays['wordPairKeys'] = self.wordPairKeys
+            arrays['wordPairCounts'] = self.wordPairCounts
+        for tableName in ('pairTransitions', 'wordTransitions'):
+            table = getattr(self, tableName)
+            if table is not None:
+                for name, array in table.getArrays().iteritems():
+                    arrays[tableName + '.' + name] = array
+        for storeName in ('symbolContexts', 'wordContexts'):
+            store = getattr(self, storeName)
+            if store is not None:
+                for name, array in store.getArrays().iteritems():
+                    arrays[storeName + '.' + name] = array
+        if self.pairSketch is not None:
+            for name, array in self.pairSketch.getArrays().iteritems():
+                arrays['pairSketch.' + name] = array
+        for name, array in arrays.iteritems():
+            # Write a new file and rename it, so arrays memory-mapped from the old file (by loadModel) stay valid.
+            fileName = os.path.join(path, name + '.npy')
+            with open(fileName + '.tmp', 'wb') as arrayFile:
+                np.save(arrayFile, array)
+            os.rename(fileName + '.tmp', fileName)
+        info = {'format': 1,
+                'model': self.model,
+                'order': self.order,
+                'textFile': self.textFile,
+                'symbols': self.symbolList,
+                'letters': sorted(self.cleanAlphabet),
+                'symbolCount': self.symbolCount,
+                'wordCount': self.wordCount,
+                'identified': self.identified,
+                'pruning': self.pruning,
+                'pruningStats': self.pruningStats,
+                'pairSketch': None if self.pairSketch is None else self.pairSketch.getInfo(),
+                'arrays': sorted(arrays)}
+        fileName = os.path.join(path, 'model.json')
+        with open(fileName + '.tmp', 'w') as infoFile:
+            json.dump(info, infoFile, indent=1)
+        os.rename(fileName + '.tmp', fileName)
+
+    @timed('loadModel')
+    def loadModel(self, path, mmap=True):
+        """
+        args:
+        path: Name of directory created by self.saveModel.
+        mmap: True to memory-map the arrays instead of reading them. (Defaults to True)
+                * Loading is then almost instant, and processes using the same model share memory.
+                * Memory-mapped arrays are read-only.
+        ---------------------------------------------------------------------------
+        Loads a model saved by self.saveModel. Replaces all data of this object.
+        Replaces the three steps self.defineAlphabet, self.feedInput and self.identifyProbabilities.
+        """
+        with open(os.path.join(path, 'model.json')) as infoFile:
+            info = json.load(infoFile)
+        if info.get('format') != 1:
+            raise ValueError("Directory does not contain a saved model of a supported format.")
+        mmapMode = 'r' if mmap else None
+        arrays = dict((name, np.load(os.path.join(path, name + '.npy'), mmap_mode=mmapMode))
+                      for name in info['arrays'])
+        # Reset object (keeping the random number generator, validate, cacheSize and self.stats), and restore alphabet.
+        stats = self.stats
+        self.__init__(info['model'], self.rng, info.get('order', 1), self.validate, cacheSize=self.cacheSize)
+        self.stats = stats
+        self.pruning.update(info.get('pruning', {}))
+        self.pruningStats = info.get('pruningStats', {})
+        self.textFile = info['textFile']
+        self.symbolList = info['symbols']
+        self.alphabet = dict(zip(self.symbolList, arrays['symbolCounts'].tolist()))
+        self.cleanAlphabet = dict((i, 0) for i in info['letters'])
+        self.createSymbolTables()
+        self.symbolCount = info['symbolCount']
+        self.wordCount = info['wordCount']
+        for i in self.symbolList:
+            self.validTransformations[i] = []
+        # Restore counts and tables.
+        if 'symbolSampler.aliasProbs' in arrays:
+            self.symbolSampler = AliasTable.fromArrays(arrays['symbolSampler.aliasProbs'],
+                                                       arrays['symbolSampler.aliasIndices'])
+            for i in self.symbolList:
+                self.normSymbols[i] = self.alphabet[i] / self.symbolCount
+        self.countedModels = set([1])
+        if 'pairCounts' in arrays:
+            self.pairCounts = arrays['pairCounts']
+            self.createPairs()
+            self.countedModels.add(2)
+        if 'vocabulary.data' in arrays:
+            # Words are decoded when used. self.wordIndex is created if more words are fed.
+            self.vocabulary = StoredVocabulary(arrays['vocabulary.data'], arrays['vocabulary.offsets'])
+            self.wordIndex = None
+            self.wordCounts = arrays['wordCounts']
+            self.wordPairKeys = arrays['wordPairKeys']
+            self.wordPairCounts = arrays['wordPairCounts']
+            self.countedModels.add(3)
+        for tableName in ('pairTransitions', 'wordTransitions'):
+            prefix = tableName + '.'
+            if prefix + 'indptr' in arrays:
+                table = TransitionTable.fromArrays(dict((name[len(prefix):], array)
+                                                        for name, array in arrays.iteritems()
+                                                        if name.startswith(prefix)), self.cacheSize)
+                setattr(self, tableName, table)
+        for storeName in ('symbolContexts', 'wordContexts'):
+            prefix = storeName + '.'
+            if prefix + 'contexts' in arrays:
+                store = ContextStore.fromArrays(self.order, dict((name[len(prefix):], array)
+                                                                 for name, array in arrays.iteritems()
+                                                                 if name.startswith(prefix)), self.cacheSize)
+                setattr(self, storeName, store)
+        if info.get('pairSketch') is not None:
+            self.pairSketch = PairSketch.fromArrays(dict((name[len('pairSketch.'):], array)
+                                                         for name, array in arrays.iteritems()
+                                                         if name.startswith('pairSketch.')), info['pairSketch'])
+        if self.pairTransitions is not None:
+            self.normalizePairs()
+        self.defined = True
+        self.fed = True
+        self.identified = info['identified']
+
+    @timed('visualizeData')
+    def visualizeData(self, model, show=0, save=0, topK=30, pixels=512):
         """
         args:
         model: Which model data to plot. You will get error message if model is not initialized.
         show: 0 to not show plots, 1 to show plots. (Defaults to 0)
         save: 0 to not save plot, 1 to save plot. (Defaults to 0)
+        topK: Number of the most frequent symbols, words or pairs shown as bars. (Defaults to 30)
+        pixels: Maximum number of blocks along each axis of the images. (Defaults to 512)
         ---------------------------------------------------------------------------
         Arranges data to make them more visually accessible.
         Visualize data based on model chosen.
+            ----MODEL 1----
+            - model1Plot1.png: All symbols arranged alphabetically.
+            - model1Plot2.png: The topK most frequent symbols.
+            - model1Plot3.png: Rank-frequency (Zipf) curve of the symbols.
+            ----MODEL 2----
+            - model2Plot1.png: The topK most frequent symbol-pairs.
+            - model2Plot2.png: Rank-frequency (Zipf) curve of the symbol-pairs.
+            - model2Plot3.png: Image of the transfer-probabilities.
+            ----MODEL 3----
+            - model3Plot1.png: The topK most frequent words.
+            - model3Plot2.png: Rank-frequency (Zipf) curves of the words and the word-pairs.
+            - model3Plot3.png: The topK most frequent word-pairs.
+            - model3Plot4.png: Image of the transfer-probabilities. Words are ranked by frequency.
+        The counts are ranked with numpy, and only the topK bars are labeled, so large vocabularies are plotted
+        in seconds. The images are created from the stored pairs, and reduced to at most pixels x pixels blocks
+        of states, so they never need the full numStates x numStates array.
+        Plots that are not shown are drawn by the Agg backend, and do not need a display.
         """
         if not self.defined:
             raise ValueError("You have not defined an alphabet for this object.")
@@ -873,316 +3186,122 @@ class AutomaticTextGenerator(object):
             raise ValueError("You have not fed any input to this object.")
         if not self.identified:
             raise ValueError("You have not identified the probabilities for this data.")
+        if show not in (0, 1):
+            print "Argument show must be 0 or 1."
+        if save not in (0, 1):
+            print "Argument save must be 0 or 1."
 
+        # List of (figure, filename) of the plots of the model.
+        figures = []
         if model == 1:
             if len(self.normSymbols) > 0:
-                # Arrange data
-                sortedKeys = []
-                sortedVals = []
-                takenVals = []
-                # Append from normSymbols, all keys to sortedKeys, and all values to sortedVals.
-                for key, val in self.normSymbols.iteritems():
-                    sortedKeys.append(key)
-                    if val not in takenVals:
-                        sortedVals.append(val)
-                        takenVals.append(val)
-                # Sort the lists, then find the corresponding keys or values in normSymbols,
-                # and replace list elements with both key and val.
-                sortedKeys.sort()
-                sortedVals.sort()
-                for j, i in enumerate(sortedKeys):
-                    if i in self.normSymbols:
-                        sortedKeys[j] = (i, self.normSymbols[i])
-                for j, i in enumerate(sortedVals):
-                    for key in self.normSymbols:
-                        if self.normSymbols[key] == i:
-                            sortedVals[j] = (key, i)
-                # Zip the sorted lists.
-                keyX, keyY = zip(*sortedKeys)
-                valX, valY = zip(*sortedVals)
-
-                # Define x-axes
-                keyXaxes = np.arange(len(keyX))
-                valXaxes = np.arange(len(valX))
-
-                # Create first plot. This plot is a histogram for sortedKeys (Symbols).
-                fig1 = plt.figure(1)
-                plt.title('Symbols arranged alphabetically.')
-                ax = fig1.gca()
-                ax.bar(keyXaxes + 0.6, keyY)
-                ax.set_xticks(keyXaxes + 1)
-                ax.set_xticklabels(keyX)
-                ax.set_xlabel('Symbols')
-                ax.set_ylabel('Number of occurrences (Normalized)')
-                ax.set_xlim(0.0, keyXaxes.max() + 2)
-                if save == 1:
-                    # Save plots
-                    plt.savefig('model1Plot1.png')
-
-                # Create second plot. This plot is a histogram for sortedVals (Symbols).
-                fig2 = plt.figure(2)
-                plt.title('Symbols arranged by ascending values. (Doubles only represented once)')
-                ax = fig2.gca()
-                ax.bar(valXaxes + 0.6, valY)
-                ax.set_xticks(valXaxes + 1)
-                ax.set_xticklabels(valX)
-                ax.set_xlabel('Symbols')
-                ax.set_ylabel('Number of occurrences (Normalized)')
-                ax.set_xlim(0.0, valXaxes.max() + 2)
-                if save == 1:
-                    # Save plots
-                    plt.savefig('model1Plot2.png')
-
-                if show == 1:
-                    # Show plots
-                    plt.show()
-                elif show == 0:
-                    pass
-                else:
-                    print "Argument show must be 0 or 1."
-                if save == 0:
-                    pass
-                elif save != 1:
-                    print "Argument save must be 0 or 1."
+                # Arrange data. Counts of the symbols, in the same order as self.symbolList.
+                counts = np.array([self.alphabet[i] for i in self.symbolList], dtype=np.int64)
+                top, sortedCounts = rankCounts(counts, topK)
+                alphabetical = sorted(range(len(self.symbolList)), key=lambda n: self.symbolList[n])
+
+                # Create first plot. This plot is a histogram of all symbols, arranged alphabetically.
+                figure = createFigure(show)
+                barPlot(figure, [symbolLabel(self.symbolList[n]) for n in alphabetical],
+                        counts[alphabetical] / counts.sum(), 'Symbols arranged alphabetically.', 'Symbols')
+                figures.append((figure, 'model1Plot1.png'))
+
+                # Create second plot. This plot is a histogram of the topK symbols.
+                figure = createFigure(show)
+                barPlot(figure, [symbolLabel(self.symbolList[n]) for n in top], counts[top] / counts.sum(),
+                        'The {0} most frequent symbols.'.format(len(top)), 'Symbols')
+                figures.append((figure, 'model1Plot2.png'))
+
+                # Create third plot. This plot is the rank-frequency curve of the symbols.
+                figure = createFigure(show)
+                zipfPlot(figure, [(sortedCounts, 'Symbols')], 'Symbols ranked by number of occurrences.')
+                figures.append((figure, 'model1Plot3.png'))
             else:
                 print "The model selected has not yet been initialized for this object."
         elif model == 2:
             if len(self.normPairs) > 0:
-                sortedVals = []
-                takenVals = []
-                # Append from normPairs, all values to sortedVals.
-                for key, val in self.normPairs.iteritems():
-                    if val not in takenVals:
-                        sortedVals.append(val)
-                        takenVals.append(val)
-                # Sort the list, then find the corresponding keys in normPairs,
-                # and replace list elements with both key and val.
-                sortedVals.sort()
-                for j, i in enumerate(sortedVals):
-                    for key in self.normPairs:
-                        if self.normPairs[key] == i:
-                            sortedVals[j] = (key, i)
-                # Create list with (key, val) elements for scrambled data plot.
-                scrambledData = []
-                for key, val in self.normPairs.iteritems():
-                    scrambledData.append((key, val))
-                # Zip the sorted list and the scrambled list.
-                sX, sY = zip(*scrambledData)
-                valX, valY = zip(*sortedVals)
-                # Define x-axes
-                sXaxes = np.arange(len(sX))
-                valXaxes = np.arange(len(valX))
-
-                # Do same thing for image plot.
-                imData = []
-                for key, val in self.alphabet.iteritems():
-                    imData.append((key, val))
-                x, y = zip(*imData)
-                xAx = np.arange(len(x))
-
-                # Create first plot. This plot is a histogram for scrambledData (Symbol-pairs).
-                fig1 = plt.figure(1)
-                plt.title('Pairs of symbols (No order)')
-                ax = fig1.gca()
-                ax.bar(sXaxes + 0.6, sY)
-                ax.set_xticks(sXaxes + 1)
-                ax.set_xticklabels(sX)
-                ax.set_xlabel('Symbol-pairs')
-                ax.set_ylabel('Number of occurrences (Normalized)')
-                ax.set_xlim(0.0, sXaxes.max() + 2)
-                if save == 1:
-                    # Save plots
-                    plt.savefig('model2Plot1.png')
-
-                 # Create second plot. This plot is a histogram for sortedVals (Symbol-pairs).
-                fig2 = plt.figure(2)
-                plt.title('Symbol-pairs arranged by ascending values. (Doubles only represented once)')
-                ax = fig2.gca()
-                ax.bar(valXaxes + 0.6, valY)
-                ax.set_xticks(valXaxes + 1)
-                ax.set_xticklabels(valX)
-                ax.set_xlabel('Symbol-pairs')
-                ax.set_ylabel('Number of occurrences (Normalized)')
-                ax.set_xlim(0.0, valXaxes.max() + 2)
-                if save == 1:
-                    # Save plots
-                    plt.savefig('model2Plot2.png')
+                # Arrange data. Pair (i, j) is at position i * numSymbols + j of the flattened self.pairCounts.
+                numSymbols = len(self.symbolList)
+                flatCounts = self.pairCounts.ravel()
+                pairs = np.flatnonzero(flatCounts)
+                counts = flatCounts[pairs]
+                top, sortedCounts = rankCounts(counts, topK)
+                labels = [symbolLabel(self.symbolList[i // numSymbols] + self.symbolList[i % numSymbols])
+                          for i in pairs[top].tolist()]
+
+                # Create first plot. This plot is a histogram of the topK symbol-pairs.
+                figure = createFigure(show)
+                barPlot(figure, labels, counts[top] / counts.sum(),
+                        'The {0} most frequent symbol-pairs.'.format(len(top)), 'Symbol-pairs')
+                figures.append((figure, 'model2Plot1.png'))
+
+                # Create second plot. This plot is the rank-frequency curve of the symbol-pairs.
+                figure = createFigure(show)
+                zipfPlot(figure, [(sortedCounts, 'Symbol-pairs')], 'Symbol-pairs ranked by number of occurrences.')
+                figures.append((figure, 'model2Plot2.png'))
 
                 # Create third plot. This plot is an image showing the transfer-probabilities.
-                fig3 = plt.figure(3)
-                plt.imshow(self.pairTableArray)
-                plt.title('Pairs of symbols (No order)')
-                ax = fig3.gca()
-                ax.set_xticks(xAx)
-                ax.set_xticklabels(x)
-                ax.set_yticks(xAx)
-                ax.set_yticklabels(x)
-                ax.set_xlabel('Symbol-pairs')
-                ax.set_ylabel('Symbol-pairs')
-                plt.colorbar()
-                if save == 1:
-                    # Save plots
-                    plt.savefig('model2Plot3.png')
-
-                if show == 1:
-                    # Show plots
-                    plt.show()
-                elif show == 0:
-                    pass
-                else:
-                    print "Argument show must be 0 or 1."
-                if save == 0:
-                    pass
-                elif save != 1:
-                    print "Argument save must be 0 or 1."
+                # The symbols are in the same order as self.symbolList, unless there are more symbols than pixels.
+                transitions = self.pairTransitions
+                order = None
+                if transitions.numStates > pixels:
+                    order = np.argsort(-transitions.rowTotals, kind='mergesort')
+                labels = [symbolLabel(i) for i in self.symbolList] if order is None else None
+                figure = createFigure(show)
+                heatmapPlot(figure, transitions.toBlocks(pixels, order), transitions.numStates, labels,
+                            'Pairs of symbols (No order)', 'Symbol-pairs')
+                figures.append((figure, 'model2Plot3.png'))
             else:
                 print "The model selected has not yet been initialized for this object."
         elif model == 3:
-            if len(self.normWordPairs) > 0:
-                # For Words
-                sortedVals = []
-                takenVals = []
-                # Append from normWordPairs, all values to sortedVals.
-                for key, val in self.normWords.iteritems():
-                    if val not in takenVals:
-                        sortedVals.append(val)
-                        takenVals.append(val)
-                # Sort the list, then find the corresponding keys in normWordPairs,
-                # and replace list elements with both key and val.
-                sortedVals.sort()
-                for j, i in enumerate(sortedVals):
-                    for key in self.normWords:
-                        if self.normWords[key] == i:
-                            sortedVals[j] = (key, i)
-                # Create list with (key, val) elements for scrambled data plot.
-                scrambledData = []
-                for key, val in self.normWords.iteritems():
-                    scrambledData.append((key, val))
-                # Zip the sorted list and the scrambled list.
-                sX, sY = zip(*scrambledData)
-                valX, valY = zip(*sortedVals)
-                # Define x-axes
-                sXaxes = np.arange(len(sX))
-                valXaxes = np.arange(len(valX))
-
-                # For wordPairs
-                sortedpairVals = []
-                takenpairVals = []
-                # Append from normWordPairs, all values to sortedpairVals.
-                for key, val in self.normWordPairs.iteritems():
-                    if val not in takenpairVals:
-                        sortedpairVals.append(val)
-                        takenpairVals.append(val)
-                # Sort the list, then find the corresponding keys in normWordPairs,
-                # and replace list elements with both key and val.
-                sortedpairVals.sort()
-                for j, i in enumerate(sortedpairVals):
-                    for key in self.normWordPairs:
-                        if self.normWordPairs[key] == i:
-                            sortedpairVals[j] = (key, i)
-                # Create list with (key, val) elements for scrambled data plot.
-                scrambledpairData = []
-                for key, val in self.normWordPairs.iteritems():
-                    scrambledpairData.append((key, val))
-                # Zip the sorted list and the scrambled list.
-                spairX, spairY = zip(*scrambledpairData)
-                valpairX, valpairY = zip(*sortedpairVals)
-                # Define x-axes
-                spairXaxes = np.arange(len(spairX))
-                valpairXaxes = np.arange(len(valpairX))
-
-                # Do same thing for image plot.
-                imData = []
-                for key, val in self.words.iteritems():
-                    imData.append((key, val))
-                x, y = zip(*imData)
-                xAx = np.arange(len(x))
-
-                # Create first plot. This plot is a histogram for scrambledData (Words).
-                fig1 = plt.figure(1)
-                plt.title('Words (No order)')
-                ax = fig1.gca()
-                ax.bar(sXaxes + 0.6, sY)
-                ax.set_xticks(sXaxes + 1)
-                ax.set_xticklabels(sX)
-                ax.set_xlabel('Words')
-                ax.set_ylabel('Number of occurrences (Normalized)')
-                ax.set_xlim(0.0, sXaxes.max() + 2)
-                if save == 1:
-                    # Save plots
-                    plt.savefig('model3Plot1.png')
-
-                 # Create second plot. This plot is a histogram for sortedVals (Words).
-                fig2 = plt.figure(2)
-                plt.title('Words arranged by ascending values. (Doubles only represented once)')
-                ax = fig2.gca()
-                ax.bar(valXaxes + 0.6, valY)
-                ax.set_xticks(valXaxes + 1)
-                ax.set_xticklabels(valX)
-                ax.set_xlabel('Words')
-                ax.set_ylabel('Number of occurrences (Normalized)')
-                ax.set_xlim(0.0, valXaxes.max() + 2)
-                if save == 1:
-                    # Save plots
-                    plt.savefig('model3Plot2.png')
-
-                # For word-pairs
-                # Create third plot. This plot is a histogram for scrambledData (Word-pairs).
-                fig1 = plt.figure(3)
-                plt.title('Pairs of words (No order)')
-                ax = fig1.gca()
-                ax.bar(spairXaxes + 0.6, spairY)
-                ax.set_xticks(spairXaxes + 1)
-                ax.set_xticklabels(spairX)
-                ax.set_xlabel('Word-pairs')
-                ax.set_ylabel('Number of occurrences (Normalized)')
-                ax.set_xlim(0.0, spairXaxes.max() + 2)
-                if save == 1:
-                    # Save plots
-                    plt.savefig('model3Plot3.png')
-
-                # Create fourth plot. This plot is a histogram for sortedVals (Word-pairs).
-                fig2 = plt.figure(4)
-                plt.title('Word-pairs arranged by ascending values. (Doubles only represented once)')
-                ax = fig2.gca()
-                ax.bar(valpairXaxes + 0.6, valpairY)
-                ax.set_xticks(valpairXaxes + 1)
-                ax.set_xticklabels(valpairX)
-                ax.set_xlabel('Word-pairs')
-                ax.set_ylabel('Number of occurrences (Normalized)')
-                ax.set_xlim(0.0, valpairXaxes.max() + 2)
-                if save == 1:
-                    # Save plots
-                    plt.savefig('model3Plot4.png')
-
-                # Create fifth plot. This plot is an image showing the transfer-probabilities.
-                fig3 = plt.figure(5)
-                plt.imshow(self.wordPairTableArray)
-                plt.title('Pairs of words (No order)')
-                ax = fig3.gca()
-                ax.set_xticks(xAx)
-                ax.set_xticklabels(x)
-                ax.set_yticks(xAx)
-                ax.set_yticklabels(x)
-                ax.set_xlabel('word-pairs')
-                ax.set_ylabel('word-pairs')
-                plt.colorbar()
-                if save == 1:
-                    # Save plots
-                    plt.savefig('model3Plot3.png')
-
-                if show == 1:
-                    # Show plots
-                    plt.show()
-                elif show == 0:
-                    pass
-                else:
-                    print "Argument show must be 0 or 1."
-                if save == 0:
-                    pass
-                elif save != 1:
-                    print "Argument save must be 0 or 1."
+            if self.wordTransitions is not None:
+                # Arrange data. Words are counted in self.wordCounts, and word-pairs in self.wordPairCounts.
+                self.consolidateWordPairs()
+                top, sortedCounts = rankCounts(self.wordCounts, topK)
+                topPairs, sortedPairCounts = rankCounts(self.wordPairCounts, topK)
+                firstWords, secondWords = self.splitWordPairKeys(self.wordPairKeys[topPairs])
+
+                # Create first plot. This plot is a histogram of the topK words.
+                figure = createFigure(show)
+                barPlot(figure, [self.vocabulary[i] for i in top.tolist()],
+                        self.wordCounts[top] / self.wordCounts.sum(),
+                        'The {0} most frequent words.'.format(len(top)), 'Words')
+                figures.append((figure, 'model3Plot1.png'))
+
+                # Create second plot. This plot is the rank-frequency curves of the words and word-pairs.
+                figure = createFigure(show)
+                zipfPlot(figure, [(sortedCounts, 'Words'), (sortedPairCounts, 'Word-pairs')],
+                         'Words and word-pairs ranked by number of occurrences.')
+                figures.append((figure, 'model3Plot2.png'))
+
+                # Create third plot. This plot is a histogram of the topK word-pairs.
+                figure = createFigure(show)
+                barPlot(figure, [self.vocabulary[i] + u" " + self.vocabulary[j] for i, j in
+                                 zip(firstWords.tolist(), secondWords.tolist())],
+                        self.wordPairCounts[topPairs] / self.wordPairCounts.sum(),
+                        'The {0} most frequent word-pairs.'.format(len(topPairs)), 'Word-pairs')
+                figures.append((figure, 'model3Plot3.png'))
+
+                # Create fourth plot. This plot is an image showing the transfer-probabilities.
+                # The words are ranked by frequency, so the most frequent words get their own blocks.
+                # Each word is only labeled if there are few enough words to read the labels.
+                order = np.argsort(-self.wordCounts, kind='mergesort')
+                labels = [self.vocabulary[i] for i in order.tolist()] if len(order) <= topK else None
+                figure = createFigure(show)
+                heatmapPlot(figure, self.wordTransitions.toBlocks(pixels, order), len(order), labels,
+                            'Pairs of words', 'Words ranked by frequency')
+                figures.append((figure, 'model3Plot4.png'))
             else:
                 print "The model selected has not yet been initialized for this object."
         else:
             print "Model argument must be ints 1, 2 or 3, representing text generator model."
+
+        if save == 1:
+            # Save plots
+            for figure, filename in figures:
+                figure.savefig(filename, bbox_inches='tight')
+        if show == 1 and figures:
+            # Show plots
+            plt.show()
+            for figure, filename in figures:
+                plt.close(figure)
@@ -0,0 +1,230 @@
+# -*- coding: cp1252 -*-
+#####################IMPORTS###################
+from __future__ import division
+import AutomaticTextGenerator as atg
+from AutomaticTextGenerator import AutomaticTextGenerator
+import multiprocessing
+import subprocess
+import argparse
+import resource
+import platform
+import numpy as np
+import timeit
+import json
+import os
+######################IMPORTS/end##############
+
+##########################################################################
+# Benchmarks for the AutomaticTextGenerator class.
+# Runs without any input from the user, and prints the results as JSON.
+#
+# For each corpus size a synthetic corpus is generated from the statistics of ugeseddel_data.txt,
+# and the following is measured in a new process:
+#     - ingest:   self.feedInput(corpus, allModels=True)                   (seconds, MB/s)
+#     - identify: self.identifyProbabilities(allModels=True)               (seconds)
+#     - generate: self.generateText(N) for each model                     (seconds, tokens/s)
+#     - memory:   peak resident memory of the process                      (MB)
+# Each corpus is measured once with each backend (numba and pure python, if numba is installed),
+# and the results are put side by side in the same case, with the speedup of the first backend.
+#
+# Example:
+#     python benchmarkAutomaton.py --sizes 1 10 100 --output results.json
+# The tests of the class are not run, since validate is False.
+##########################################################################
+
+
+def createCorpus(filename, size, seed, order=4):
+    """
+    args:
+    filename: Name of file to write the corpus to.
+    size: Size of the corpus in bytes. (Approximately)
+    seed: Seed of the random numbers used to generate the corpus.
+    order: Order of the symbol model the corpus is generated with. (Defaults to 4)
+    ---------------------------------------------------------------------------
+    Generates a synthetic corpus from the statistics of ugeseddel_data.txt, with model 2 of the given order.
+    The corpus contains the same symbols, words and punctuation as the data, but can be as large as needed.
+    """
+    generator = AutomaticTextGenerator(2, seed, order)
+    generator.defineAlphabet("ABCs.txt")
+    generator.feedInput("ugeseddel_data.txt")
+    generator.identifyProbabilities()
+    # Most symbols are encoded as one byte, so size symbols is approximately size bytes.
+    generator.generateToFile(filename, size)
+
+
+def peakMemory():
+    """
+    return:
+    Peak resident memory of this process in MB.
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def warmUp():
+    """
+    return:
+    Seconds used to compile the numba kernels, or load them from the cache of numba.
+    ---------------------------------------------------------------------------
+    Calls the kernels once on a table of two states, so the compilation is not timed as part of the benchmarks.
+    """
+    start = timeit.default_timer()
+    table = atg.TransitionTable(np.array([0, 1]), np.array([1, 0]), np.array([1, 1]), 2)
+    table.walk(-1, np.zeros(2))
+    return timeit.default_timer() - start
+
+
+def runCase(args):
+    """
+    args:
+    args: Tuple (corpus, models, tokens, order, seed, backend, cacheSize, pruning, sketch).
+            * pruning is a dictionary of the pruning arguments of identifyProbabilities.
+            * sketch is a list [width, depth, capacity] of a PairSketch, or None to count word-pairs exactly.
+    return:
+    Dictionary of the results of one corpus.
+    ---------------------------------------------------------------------------
+    Measures ingest, identify and generate for one corpus. Runs in its own process, so the peak memory is
+    the peak memory of this corpus only.
+    """
+    corpus, models, tokens, order, seed, backend, cacheSize, pruning, sketch = args
+    atg.backend = backend
+    size = os.path.getsize(corpus)
+    result = {'corpusBytes': size}
+    if backend == 'numba':
+        result['compileSeconds'] = warmUp()
+    pairSketch = None if sketch is None else atg.PairSketch(*sketch)
+    generator = AutomaticTextGenerator(1, seed, order, cacheSize=cacheSize, pairSketch=pairSketch)
+    generator.defineAlphabet("ABCs.txt")
+    start = timeit.default_timer()
+    generator.feedInput(corpus, keepText=False, allModels=True)
+    stop = timeit.default_timer()
+    result['ingest'] = {'seconds': stop - start, 'MBPerSecond': size / 2**20 / (stop - start)}
+    start = timeit.default_timer()
+    generator.identifyProbabilities(allModels=True, **pruning)
+    stop = timeit.default_timer()
+    result['identify'] = {'seconds': stop - start}
+    result['pruning'] = generator.pruningStats
+    if pairSketch is not None:
+        result['pairSketch'] = pairSketch.errorBounds()
+    result['symbols'] = generator.symbolCount
+    result['words'] = generator.wordCount
+    result['vocabulary'] = len(generator.vocabulary)
+    result['wordPairs'] = generator.wordTransitions.nnz()
+    result['generate'] = {}
+    for model in models:
+        generator.changeModel(model)
+        start = timeit.default_timer()
+        generator.generateText(tokens)
+        stop = timeit.default_timer()
+        result['generate'][str(model)] = {'tokens': tokens, 'seconds': stop - start,
+                                          'tokensPerSecond': tokens / (stop - start)}
+        # Hits and misses of the rows created when they were used. (See LazyTransitionTable)
+        store = generator.getContextStore()
+        transitions = store.transitions if store is not None else generator.wordTransitions
+        if model == 3 and isinstance(transitions, atg.LazyTransitionTable):
+            result['generate'][str(model)]['rowCache'] = transitions.cacheInfo()
+    result['peakMemoryMB'] = peakMemory()
+    # Timers and counters of the generator. (See AutomaticTextGenerator.Instrumentation)
+    result['stats'] = generator.stats.report()
+    return result
+
+
+def speedups(results, baseline):
+    """
+    args:
+    results: Dictionary of the results of runCase for each backend.
+    baseline: Name of the backend the others are compared with.
+    return:
+    Dictionary of the speedup of each other backend for ingest, identify and each generated model.
+    (Seconds of baseline / seconds of the backend. Under 1.0 if the backend is slower)
+    """
+    speedup = {}
+    for backend, result in results.iteritems():
+        if backend == baseline:
+            continue
+        base = results[baseline]
+        speedup[backend] = {'ingest': base['ingest']['seconds'] / result['ingest']['seconds'],
+                            'identify': base['identify']['seconds'] / result['identify']['seconds'],
+                            'generate': dict((model, base['generate'][model]['seconds'] / timing['seconds'])
+                                             for model, timing in result['generate'].iteritems())}
+    return speedup
+
+
+def gitCommit():
+    """
+    return:
+    Hash of the current git commit, or None if it can not be found.
+    """
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=devnull).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    """
+    Parses the arguments, runs the benchmarks and prints or saves the results.
+    """
+    parser = argparse.ArgumentParser(description="Benchmarks for AutomaticTextGenerator.")
+    parser.add_argument('--sizes', type=float, nargs='+', default=[1, 10],
+                        help="Corpus sizes in MB. (Defaults to 1 10)")
+    parser.add_argument('--models', type=int, nargs='+', default=[1, 2, 3],
+                        help="Models to generate text with. (Defaults to 1 2 3)")
+    parser.add_argument('--tokens', type=int, default=10**5,
+                        help="Symbols or words generated by each model. (Defaults to 100000)")
+    parser.add_argument('--order', type=int, default=1, help="Order of the models. (Defaults to 1)")
+    parser.add_argument('--cacheSize', type=int, default=None,
+                        help="Create rows when used, and keep at most cacheSize rows. (Defaults to creating all rows)")
+    parser.add_argument('--minWordCount', type=int, default=None, help="Prune words of model 3 with a lower count.")
+    parser.add_argument('--minPairCount', type=int, default=None, help="Prune word-pairs with a lower count.")
+    parser.add_argument('--topK', type=int, default=None, help="Keep at most topK successors of each word.")
+    parser.add_argument('--sketch', type=int, nargs=3, default=None, metavar=('WIDTH', 'DEPTH', 'CAPACITY'),
+                        help="Count word-pairs with a PairSketch. (Defaults to counting them exactly)")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of corpora and generated texts. (Defaults to 0)")
+    parser.add_argument('--backends', choices=['numba', 'python'], nargs='+',
+                        default=['python'] if atg.numba is None else ['numba', 'python'],
+                        help="Backends of the kernels to compare. The others are compared with the last one. "
+                             "(Defaults to numba python, or python if numba is not installed)")
+    parser.add_argument('--corpusDir', default='benchmarkCorpora',
+                        help="Directory of the synthetic corpora. Corpora are reused if they exist.")
+    parser.add_argument('--output', default=None, help="File to save the results in. (Defaults to printing them)")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.corpusDir):
+        os.makedirs(args.corpusDir)
+    results = {'commit': gitCommit(),
+               'python': platform.python_version(),
+               'backends': args.backends,
+               'order': args.order,
+               'cacheSize': args.cacheSize,
+               'sketch': args.sketch,
+               'pruning': {'minWordCount': args.minWordCount, 'minPairCount': args.minPairCount, 'topK': args.topK},
+               'seed': args.seed,
+               'cases': []}
+    for size in args.sizes:
+        corpus = os.path.join(args.corpusDir, "corpus_{0}MB_seed{1}.txt".format(size, args.seed))
+        if not os.path.exists(corpus):
+            createCorpus(corpus, int(size * 2**20), args.seed)
+        case = {'sizeMB': size, 'corpusBytes': os.path.getsize(corpus)}
+        for backend in args.backends:
+            # Run each corpus and backend in a new process. (maxtasksperchild=1)
+            pool = multiprocessing.Pool(1, maxtasksperchild=1)
+            try:
+                case[backend] = pool.apply(runCase, ((corpus, args.models, args.tokens, args.order, args.seed,
+                                                      backend, args.cacheSize, results['pruning'], args.sketch),))
+            finally:
+                pool.close()
+                pool.join()
+        case['speedup'] = speedups(dict((backend, case[backend]) for backend in args.backends), args.backends[-1])
+        results['cases'].append(case)
+
+    output = json.dumps(results, indent=1, sort_keys=True)
+    if args.output is None:
+        print output
+    else:
+        with open(args.output, 'w') as outputFile:
+            outputFile.write(output)
+
+
+if __name__ == '__main__':
+    main()
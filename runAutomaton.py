@@ -27,7 +27,7 @@ if Q1 != 'n':
     print "Initializing new AutomaticTextGenerator object, as model 1."
     iniStart = time.clock()
     start = time.clock()
-    newTextGenerator1 = AutomaticTextGenerator(1)
+    newTextGenerator1 = AutomaticTextGenerator(1, validate=__debug__)
     newTextGenerator1.defineAlphabet("ABCs.txt")
     newTextGenerator1.feedInput("ugeseddel_data.txt")
     newTextGenerator1.identifyProbabilities()
@@ -36,7 +36,7 @@ if Q1 != 'n':
     print "~"*80
     print "Initializing new AutomaticTextGenerator object, as model 2."
     start = time.clock()
-    newTextGenerator2 = AutomaticTextGenerator(2)
+    newTextGenerator2 = AutomaticTextGenerator(2, validate=__debug__)
     newTextGenerator2.defineAlphabet("ABCs.txt")
     newTextGenerator2.feedInput("ugeseddel_data.txt")
     newTextGenerator2.identifyProbabilities()
@@ -45,7 +45,7 @@ if Q1 != 'n':
     print "~"*80
     print "Initializing new AutomaticTextGenerator object, as model 3."
     start = time.clock()
-    newTextGenerator3 = AutomaticTextGenerator(3)
+    newTextGenerator3 = AutomaticTextGenerator(3, validate=__debug__)
     newTextGenerator3.defineAlphabet("ABCs.txt")
     newTextGenerator3.feedInput("ugeseddel_data.txt")
     newTextGenerator3.identifyProbabilities()
@@ -63,11 +63,11 @@ if Q1 != 'n':
     del newTextGenerator1, newTextGenerator2, newTextGenerator3
     start = time.clock()
     print "~"*80
-    print "Initializing object as model 1."
-    newTextGenerator = AutomaticTextGenerator(1)
+    print "Initializing object as model 1. (Counting for all models while reading the file once)"
+    newTextGenerator = AutomaticTextGenerator(1, validate=__debug__)
     newTextGenerator.defineAlphabet("ABCs.txt")
-    newTextGenerator.feedInput("ugeseddel_data.txt")
-    newTextGenerator.identifyProbabilities()
+    newTextGenerator.feedInput("ugeseddel_data.txt", allModels=True)
+    newTextGenerator.identifyProbabilities(allModels=True)
     print "~"*80
     print "Changing to model 2."
     newTextGenerator.changeModel(2)
@@ -124,6 +124,16 @@ if Q1 != 'n':
           "\n Model 1: {0} seconds. \n Model 2: {1} seconds. \n Model 3: {2} seconds.".format(gen1T, gen2T, gen3T)
     print "Total time to do this: {0} seconds.".format(genTotal)
     print
+    print "The same 10 texts for each model can be generated in parallel, with one process per core."
+    raw_input("Press Enter to continue...")
+    for model in [1, 2, 3]:
+        newTextGenerator.changeModel(model)
+        start = time.time()
+        batch = newTextGenerator.generateBatch(10, 1000)
+        stop = time.time()
+        print "~"*80
+        print "Model {0}: generated {1} texts in parallel in {2} seconds.".format(model, len(batch), stop - start)
+    print
     print "To demonstrate that saving a new text does indeed work, the program will now save one of each texts."
     raw_input("Press Enter to continue...")
     newTextGenerator.changeModel(1)
@@ -155,7 +165,7 @@ Q2 = raw_input("Do you want to run negative tests? ('n' for no, any other key fo
 if Q2 != 'n':
     print "~"*80
     print "First initialise new object for all models."
-    negativeGenerator = AutomaticTextGenerator(1)
+    negativeGenerator = AutomaticTextGenerator(1, validate=__debug__)
     negativeGenerator.defineAlphabet("ABCs.txt")
     negativeGenerator.feedInput("ugeseddel_data.txt")
     negativeGenerator.identifyProbabilities()
@@ -182,7 +192,7 @@ if Q2 != 'n':
     raw_input("Press Enter to continue...")
     print "~"*80
     print "Initialise new object, but don't call initialisation methods."
-    newNegativeGenerator = AutomaticTextGenerator(1)
+    newNegativeGenerator = AutomaticTextGenerator(1, validate=__debug__)
     print "Then try to initialise methods in wrong order."
     try:
         newNegativeGenerator.feedInput("ugeseddel_data.txt")
@@ -212,10 +222,10 @@ if Q3 != 'n':
     print "~"*80
     print "First initialises new object, for each model."
     raw_input("Press Enter to continue...")
-    plottingGenerator = AutomaticTextGenerator(1)
+    plottingGenerator = AutomaticTextGenerator(1, validate=__debug__)
     plottingGenerator.defineAlphabet("ABCs.txt")
-    plottingGenerator.feedInput("ugeseddel_data.txt")
-    plottingGenerator.identifyProbabilities()
+    plottingGenerator.feedInput("ugeseddel_data.txt", allModels=True)
+    plottingGenerator.identifyProbabilities(allModels=True)
     plottingGenerator.changeModel(2)
     plottingGenerator.changeModel(3)
     print "~"*80
@@ -226,20 +236,20 @@ if Q3 != 'n':
             print "Showing plots for model 1:"
             print "Close plot windows to continue..."
             plottingGenerator.visualizeData(1, 1, 1)
-            print "Showing plots for model 2 (Might take a while):"
+            print "Showing plots for model 2:"
             print "Close plot windows to continue..."
             plottingGenerator.visualizeData(2, 1, 1)
-            print "Showing plots for model 3 (Might take a while):"
+            print "Showing plots for model 3:"
             print "Close plot windows to continue..."
             plottingGenerator.visualizeData(3, 1, 1)
         elif Q31 != 'n' and Q32 == 'n':
             print "Showing plots for model 1:"
             print "Close plot windows to continue..."
             plottingGenerator.visualizeData(1, 1, 0)
-            print "Showing plots for model 2 (Might take a while):"
+            print "Showing plots for model 2:"
             print "Close plot windows to continue..."
             plottingGenerator.visualizeData(2, 1, 0)
-            print "Showing plots for model 3 (Might take a while):"
+            print "Showing plots for model 3:"
             print "Close plot windows to continue..."
             plottingGenerator.visualizeData(3, 1, 0)
         elif Q31 == 'n' and Q32 != 'n':
@@ -262,7 +272,7 @@ Q4 = raw_input("Do you want to run 'other texts' test?('n' for no, any other key
 
 if Q4 != 'n':
     print "Inititalises new text generator object."
-    extraGenerator = AutomaticTextGenerator(3)
+    extraGenerator = AutomaticTextGenerator(3, validate=__debug__)
     extraGenerator.defineAlphabet("ABCs.txt")
     print "~"*80
     Q41 = raw_input("Do you want to run 'Introduction to Programming' test?(662KB)('n' for no, any other key for yes.)")